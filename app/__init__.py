@@ -7,40 +7,156 @@ Factory de la aplicación Flask (Web_v2).
 - Inicializa extensiones (mail, db).
 - Carga configuración desde entorno (.env soportado vía wsgi.py).
 - Crea esquema de BD y carpetas de runtime.
-- Define filtros Jinja útiles y comandos CLI:
+- Registra filtros Jinja (app/template_helpers.py) y comandos CLI:
     * send-test-email
     * purge-comprobantes
     * purge-seat-holds
+    * purge-reset-tokens
 """
 
 from __future__ import annotations
 
+import atexit
 import os
+import queue
 from datetime import timedelta
+from logging.handlers import QueueHandler, QueueListener
+
 from flask import Flask, request, redirect, url_for, flash
 
 # Extensiones
-from .extensions import mail
+from .extensions import limiter, mail
 from app import db as db_mod  # usamos db_mod.init_app y db_mod.create_schema
 
-# Blueprints (solo los necesarios en modo MP-only)
-from .blueprints.main import bp as main_bp
-from .blueprints.venta import bp as venta_bp
-from .blueprints.pago import bp as pago_bp        # <-- MP-only (GET/POST /pago y /pago/mp/*)
-from .blueprints.archivos import bp as archivos_bp
-from .blueprints.auth import bp as auth_bp
-
+# Blueprints: se importan dentro de create_app() para que `import app` (CLI, tests)
+# no arrastre PDF/QR/Mercado Pago/email hasta que realmente se arma la aplicación.
 # NOTA: Eliminamos import/registro de blueprints que chocaban/duplicaban rutas:
 # - from .blueprints.mercadopago import bp as mercadopago_bp   (NO registrar)
 # - from .blueprints.pago_mp import bp as pago_mp_bp           (NO registrar)
 # - from app.mp_routes import mp_bp                            (NO registrar fuera de create_app)
+# El webhook de MP que corre es pago.mp_webhook (/pago/mp/webhook).
+
+
+# Carpetas de runtime ya creadas en este proceso. Con gunicorn `preload_app`
+# el master las crea una vez y los workers forkeados heredan el set.
+_RUNTIME_DIRS_READY: set[str] = set()
+
+_NO_STORE_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
+
+_TRUE_VALUES = frozenset({"1", "true", "yes", "y", "on"})
+
+# Log a archivo: (logger, QueueHandler, handler de archivo, QueueListener) del
+# create_app() vigente. Los hooks de atexit y fork se registran una sola vez
+# (abajo) y siempre actúan sobre este, aunque se cree más de una app.
+_log_pipeline = None
+
+
+def _stop_log_listener() -> None:
+    """Vacía la cola y detiene el listener vigente (atexit)."""
+    if _log_pipeline is not None:
+        _log_pipeline[3].stop()
+
+
+def _start_log_listener(logger, queue_handler: QueueHandler, handler) -> None:
+    global _log_pipeline
+    if _log_pipeline is not None:
+        # create_app() repetido (tests, scripts): se reemplaza el anterior
+        old_logger, old_qh, old_handler, old_listener = _log_pipeline
+        old_listener.stop()
+        old_logger.removeHandler(old_qh)
+        old_handler.close()
+    listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    _log_pipeline = (logger, queue_handler, handler, listener)
+
 
+def _restart_log_listener_in_child() -> None:
+    # gunicorn con preload_app hace fork después de create_app(): el hilo
+    # del listener no pasa al worker, así que cada hijo arranca el suyo
+    # con una cola nueva (la heredada puede tener su lock tomado).
+    global _log_pipeline
+    if _log_pipeline is None:
+        return
+    logger, queue_handler, handler, _ = _log_pipeline
+    queue_handler.queue = queue.Queue(-1)
+    listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    _log_pipeline = (logger, queue_handler, handler, listener)
 
-def _bool_env(name: str, default: bool = False) -> bool:
-    v = os.getenv(name)
+
+atexit.register(_stop_log_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_log_listener_in_child)
+
+
+def _bool_env(env, name: str, default: bool = False) -> bool:
+    v = env.get(name)
     if v is None:
         return default
-    return str(v).strip().lower() in {"1", "true", "yes", "y", "on"}
+    return str(v).strip().lower() in _TRUE_VALUES
+
+
+def _bootstrap_schema(app: Flask) -> None:
+    """
+    Aplica migraciones + esquema y marca la BD con SCHEMA_VERSION.
+    Sólo se marca si todos los pasos salieron bien: si no, el fast path de
+    create_app no aplica y el próximo arranque vuelve a intentarlo.
+    Requiere app_context activo.
+    """
+    ok = True
+
+    # Verificar y ejecutar migraciones de MercadoPago si es necesario
+    from app.db_migrations import check_migration_needed, migrate_add_mercadopago_support, migrate_add_password_reset_support
+    try:
+        if check_migration_needed():
+            app.logger.info("Ejecutando migración de MercadoPago...")
+            if migrate_add_mercadopago_support():
+                app.logger.info("✅ Migración de MercadoPago completada")
+            else:
+                ok = False
+                app.logger.error("❌ Error en migración de MercadoPago")
+    except Exception as e:
+        ok = False
+        app.logger.warning("No se pudo verificar/aplicar migración MP: %s", e)
+
+    # Ejecutar migración de recuperación de contraseñas
+    try:
+        app.logger.info("Ejecutando migración de recuperación de contraseñas...")
+        migrate_add_password_reset_support()
+    except Exception as e:
+        ok = False
+        app.logger.warning("No se pudo aplicar migración de reset de contraseñas: %s", e)
+
+    # asegura tablas (usuarios, transacciones, seats, etc.)
+    db_mod.create_schema()
+    if not ok:
+        app.logger.warning(
+            "Esquema de BD sin marcar (versión %s): hubo migraciones con error, se reintentan en el próximo arranque",
+            db_mod.get_schema_version(),
+        )
+        return
+    db_mod.set_schema_version()
+    app.logger.info("Esquema de BD en versión %s", db_mod.SCHEMA_VERSION)
+
+
+def _warm_templates(app: Flask) -> None:
+    """Carga en el cache de Jinja todas las plantillas .html y de email (.txt)."""
+    from jinja2 import TemplateError
+
+    env = app.jinja_env
+    names = [n for n in env.list_templates() if n.endswith((".html", ".txt"))]
+    if env.cache is not None and env.cache.capacity < len(names):
+        from jinja2.utils import LRUCache
+        env.cache = LRUCache(max(400, len(names)))
+    for name in names:
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            app.logger.warning("No se pudo precompilar la plantilla %s: %s", name, e)
 
 
 def create_app() -> Flask:
@@ -54,152 +170,179 @@ def create_app() -> Flask:
     )
 
     # ----------------- Configuración ----------------- #
+    # Snapshot del entorno (dict plano): las lecturas de abajo son dict.get() sin
+    # pasar por os.environ (que codifica/decodifica la clave en cada acceso).
+    env = os.environ.copy()
+
     # Seguridad / sesión
-    app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET", "change-me-in-dev-only")
+    app.config["SECRET_KEY"] = env.get("FLASK_SECRET", "change-me-in-dev-only")
     app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=6)
     app.config["SESSION_COOKIE_HTTPONLY"] = True
     app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
-    app.config["SESSION_COOKIE_SECURE"] = _bool_env("SESSION_COOKIE_SECURE", False)  # activar en prod HTTPS
+    app.config["SESSION_COOKIE_SECURE"] = _bool_env(env, "SESSION_COOKIE_SECURE", False)  # activar en prod HTTPS
+    # Hash de contraseñas (ver app/auth_utils.py); vacío = scrypt:32768:8:1
+    app.config["PASSWORD_HASH_METHOD"] = env.get("PASSWORD_HASH_METHOD", "")
+    # Solo para tests/fixtures: reutiliza el hash (y la sal) de contraseñas repetidas
+    app.config["PASSWORD_HASH_CACHE"] = _bool_env(env, "PASSWORD_HASH_CACHE", False)
+
+    # URL pública (detrás de nginx) para links en emails; vacía = host del request
+    app.config["PUBLIC_BASE_URL"] = (env.get("PUBLIC_BASE_URL") or env.get("BASE_URL") or "").strip()
+
+    # Saltos de proxy confiables para X-Forwarded-For (ProxyFix). El deploy corre
+    # detrás de nginx (gunicorn escucha en 127.0.0.1), así que por defecto 1:
+    # sin esto request.remote_addr es siempre 127.0.0.1 y los rate limits por IP
+    # meten a todos los clientes en el mismo balde. 0 si la app se expone directo.
+    app.config["PROXY_FIX_X_FOR"] = int(env.get("PROXY_FIX_X_FOR", "1"))
 
     # (Opcional) Para que url_for(..., _external=True) genere URLs públicas correctas:
-    # app.config["SERVER_NAME"] = os.getenv("SERVER_NAME", "is-lr3d.shop")
-    # app.config["PREFERRED_URL_SCHEME"] = os.getenv("PREFERRED_URL_SCHEME", "https")
+    # app.config["SERVER_NAME"] = env.get("SERVER_NAME", "is-lr3d.shop")
+    # app.config["PREFERRED_URL_SCHEME"] = env.get("PREFERRED_URL_SCHEME", "https")
 
     # Cache estáticos
     app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 60 * 60 * 24 * 7  # 7 días
 
     # Mail / SMTP (usado por Flask-Mail y nuestro emailer)
-    app.config["MAIL_SERVER"] = os.getenv("SMTP_SERVER", "localhost")
-    app.config["MAIL_PORT"] = int(os.getenv("SMTP_PORT", "25"))
-    app.config["MAIL_USERNAME"] = os.getenv("SMTP_USER", "")
-    app.config["MAIL_PASSWORD"] = os.getenv("SMTP_PASS", "")
-    app.config["MAIL_USE_TLS"] = _bool_env("SMTP_TLS", True)
-    app.config["MAIL_USE_SSL"] = _bool_env("SMTP_SSL", False)
+    app.config["MAIL_SERVER"] = env.get("SMTP_SERVER", "localhost")
+    app.config["MAIL_PORT"] = int(env.get("SMTP_PORT", "25"))
+    app.config["MAIL_USERNAME"] = env.get("SMTP_USER", "")
+    app.config["MAIL_PASSWORD"] = env.get("SMTP_PASS", "")
+    app.config["MAIL_USE_TLS"] = _bool_env(env, "SMTP_TLS", True)
+    app.config["MAIL_USE_SSL"] = _bool_env(env, "SMTP_SSL", False)
     app.config["MAIL_DEFAULT_SENDER"] = (
-        os.getenv("SENDER_NAME", "Cinema3D"),
-        os.getenv("SMTP_USER", ""),
+        env.get("SENDER_NAME", "Cinema3D"),
+        env.get("SMTP_USER", ""),
     )
     # EMAIL_DEBUG=1 => NO enviamos correos, solo log informativo (ver emailer.py)
-    app.config["EMAIL_DEBUG"] = _bool_env("EMAIL_DEBUG", True)
-    app.config["SMTP_DEBUG"] = _bool_env("SMTP_DEBUG", False)
+    app.config["EMAIL_DEBUG"] = _bool_env(env, "EMAIL_DEBUG", True)
+    app.config["SMTP_DEBUG"] = _bool_env(env, "SMTP_DEBUG", False)
 
     # Negocio / rutas de archivos
-    app.config["DEFAULT_BRANCH"] = os.getenv("DEFAULT_BRANCH", "Cine Pelagio B. Luna 960")
-    app.config["DB_PATH"] = os.getenv("DB_PATH", "usuarios.db")
-    app.config["COMPROBANTES_DIR"] = os.getenv("COMPROBANTES_DIR", "static/comprobantes")
-    app.config["QR_DIR"] = os.getenv("QR_DIR", "static/qr")
-    app.config["QR_SIGN_SECRET"] = os.getenv("QR_SIGN_SECRET")  # opcional
+    app.config["DEFAULT_BRANCH"] = env.get("DEFAULT_BRANCH", "Cine Pelagio B. Luna 960")
+    app.config["DB_PATH"] = env.get("DB_PATH", "usuarios.db")
+    app.config["COMPROBANTES_DIR"] = env.get("COMPROBANTES_DIR", "static/comprobantes")
+    app.config["QR_DIR"] = env.get("QR_DIR", "static/qr")
+    # Descarga de comprobantes delegada a nginx (X-Accel-Redirect). Requiere la
+    # location `internal` de deploy/nginx_cinema3d.conf; en dev queda apagado.
+    app.config["USE_X_ACCEL"] = _bool_env(env, "USE_X_ACCEL", False)
+    app.config["X_ACCEL_COMPROBANTES_PREFIX"] = env.get("X_ACCEL_COMPROBANTES_PREFIX", "/_protected/comprobantes/")
+    app.config["QR_SIGN_SECRET"] = env.get("QR_SIGN_SECRET")  # opcional
 
     # Parámetros de butacas (usados por reserva de asientos)
-    app.config.setdefault("SEAT_ROWS", os.getenv("SEAT_ROWS", "ABCDEFGHIJ"))
-    app.config.setdefault("SEAT_COLS", int(os.getenv("SEAT_COLS", "12")))
-    app.config.setdefault("SEAT_MAX_PER_ORDER", int(os.getenv("SEAT_MAX_PER_ORDER", "6")))
-    app.config.setdefault("HOLD_TTL_SECONDS", int(os.getenv("HOLD_TTL_SECONDS", "600")))  # 10min por defecto
+    app.config.setdefault("SEAT_ROWS", env.get("SEAT_ROWS", "ABCDEFGHIJ"))
+    app.config.setdefault("SEAT_COLS", int(env.get("SEAT_COLS", "12")))
+    app.config.setdefault("SEAT_MAX_PER_ORDER", int(env.get("SEAT_MAX_PER_ORDER", "6")))
+    app.config.setdefault("HOLD_TTL_SECONDS", int(env.get("HOLD_TTL_SECONDS", "600")))  # 10min por defecto
 
     # Precio de entrada (para cálculo server-side del total)
-    app.config.setdefault("TICKET_PRICE", os.getenv("TICKET_PRICE", "5000"))
+    app.config.setdefault("TICKET_PRICE", env.get("TICKET_PRICE", "5000"))
 
     # Mercado Pago (mantenemos por compatibilidad; el blueprint lee del entorno)
-    app.config["MP_ACCESS_TOKEN"] = os.getenv("MP_ACCESS_TOKEN", "")
-    app.config["MP_PUBLIC_KEY"] = os.getenv("MP_PUBLIC_KEY", "")
+    app.config["MP_ACCESS_TOKEN"] = env.get("MP_ACCESS_TOKEN", "")
+    app.config["MP_PUBLIC_KEY"] = env.get("MP_PUBLIC_KEY", "")
     # Compatibilidad con nombres antiguos, por si otro módulo los usa:
-    app.config["MERCADOPAGO_ACCESS_TOKEN"] = os.getenv("MERCADOPAGO_ACCESS_TOKEN", "")
-    app.config["MERCADOPAGO_PUBLIC_KEY"] = os.getenv("MERCADOPAGO_PUBLIC_KEY", "")
+    app.config["MERCADOPAGO_ACCESS_TOKEN"] = env.get("MERCADOPAGO_ACCESS_TOKEN", "")
+    app.config["MERCADOPAGO_PUBLIC_KEY"] = env.get("MERCADOPAGO_PUBLIC_KEY", "")
+
+    # Rate limiting (Flask-Limiter). En prod usar Redis para compartir los
+    # contadores entre workers de gunicorn: RATELIMIT_STORAGE_URI=redis://localhost:6379/0
+    app.config["RATELIMIT_STORAGE_URI"] = env.get("RATELIMIT_STORAGE_URI", "memory://")
+    app.config["RATELIMIT_STRATEGY"] = "moving-window"
+    app.config["RATELIMIT_HEADERS_ENABLED"] = True  # incluye Retry-After en el 429
+    # Si Redis no responde, contar en memoria del worker en vez de devolver 500
+    app.config["RATELIMIT_IN_MEMORY_FALLBACK_ENABLED"] = True
+
+    if app.config["PROXY_FIX_X_FOR"] > 0:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
 
     # ----------------- Extensiones ----------------- #
     mail.init_app(app)     # Flask-Mail
+    if limiter is not None:
+        limiter.init_app(app)  # Flask-Limiter (opcional)
     db_mod.init_app(app)   # registra teardown y comando `flask init-db`
 
     # ----------------- Blueprints ----------------- #
+    # Import diferido (ver nota arriba). No se registran "al primer request":
+    # Flask no admite register_blueprint una vez atendida una petición y url_for
+    # necesita todas las reglas desde el arranque.
+    from .blueprints.main import bp as main_bp
+    from .blueprints.venta import bp as venta_bp
+    from .blueprints.pago import bp as pago_bp        # <-- MP-only (GET/POST /pago y /pago/mp/*)
+    from .blueprints.archivos import bp as archivos_bp
+    from .blueprints.auth import bp as auth_bp
+    from .blueprints.admin import bp as admin_bp
+
     app.register_blueprint(main_bp)      # "/", "/bienvenida", set/clear branch
     app.register_blueprint(venta_bp)     # "/cartelera", "/reserva-asientos", etc.
     app.register_blueprint(pago_bp)      # "/pago" + "/pago/mp/*" (MP-only)
     app.register_blueprint(archivos_bp)  # "/comprobante/<id>/descargar"
     app.register_blueprint(auth_bp)      # "/login", "/logout", "/registro"
-
-    # Importar y registrar blueprint de administración
-    from app.blueprints.admin import bp as admin_bp
     app.register_blueprint(admin_bp)     # "/admin/*"
 
     # ----------------- Guardia de checkout (login requerido) ----------------- #
+    from .blueprints.auth import is_logged_in
+
+    # Endpoints protegidos (ajustá si querés incluir más pasos). Se calculan una vez
+    # recorriendo url_map: en cada request solo queda una búsqueda en el set.
+    # El webhook de MP queda afuera: lo llama el servidor de MP, sin sesión.
+    protected_endpoints = frozenset(
+        r.endpoint for r in app.url_map.iter_rules()
+        if (r.endpoint.startswith("pago.") and r.endpoint != "pago.mp_webhook")
+        or r.endpoint == "venta.confirmacion"
+    )
+
     @app.before_request
     def _guard_checkout():
         """
         Obliga a estar logueado para acceder a pago y confirmación.
         Evita que, tras logout, el usuario pueda ir a MP/confirmación por caché o deep link.
         """
-        ep = (request.endpoint or "")
-        # Endpoints protegidos (ajustá si querés incluir más pasos)
-        protected = ep.startswith("pago.") or ep in ("venta.confirmacion",)
-        if protected:
-            from app.blueprints.auth import is_logged_in  # import local para evitar ciclos
-            if not is_logged_in():
-                flash("Debés iniciar sesión para continuar con el pago.", "error")
-                # `next` vuelve exactamente a donde quería ir
-                return redirect(url_for("auth.login", next=request.url))
+        if request.endpoint in protected_endpoints and not is_logged_in():
+            flash("Debés iniciar sesión para continuar con el pago.", "error")
+            # `next` vuelve exactamente a donde quería ir
+            return redirect(url_for("auth.login", next=request.url))
 
     # ----------------- Filtros y context processors ----------------- #
-    @app.template_filter("peso")
-    def _peso(value):
-        """Formatea números como moneda ARS: $ 1.234,56"""
+    from .template_helpers import peso, from_json, inject_auth_functions
+    app.add_template_filter(peso, "peso")
+    app.add_template_filter(from_json, "from_json")
+    app.context_processor(inject_auth_functions)
+
+    # ----------------- Precompilado de plantillas ----------------- #
+    # Fuera de debug, parseamos/compilamos todas las plantillas al arrancar (con
+    # preload_app lo hace el master una vez) y el primer request no paga el costo.
+    if not app.debug:
+        _warm_templates(app)
+        # Ídem SDK de Mercado Pago (import + construcción); no abre conexiones
+        from .blueprints.pago import warm_mp_sdk
         try:
-            return f"$ {float(value):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        except Exception:
-            return value
+            warm_mp_sdk()
+        except Exception as e:
+            app.logger.warning("No se pudo precargar el SDK de Mercado Pago: %s", e)
 
-    @app.template_filter("from_json")
-    def _from_json(value):
-        """Convierte string JSON a objeto Python"""
-        try:
-            import json
-            if isinstance(value, str):
-                return json.loads(value)
-            return value
-        except Exception:
-            return []
-
-    @app.context_processor
-    def inject_auth_functions():
-        from app.blueprints.auth import current_user, is_logged_in, is_admin
-        return {
-            'current_user': current_user,
-            'is_logged_in': is_logged_in,
-            'is_admin': is_admin
-        }
+    # Back URLs de MP: con PUBLIC_BASE_URL son constantes; se validan al arrancar
+    from .blueprints.pago import check_mp_back_urls
+    check_mp_back_urls(app)
 
     # ----------------- DB & runtime bootstrap ----------------- #
     with app.app_context():
-        # Verificar y ejecutar migraciones de MercadoPago si es necesario
-        from app.db_migrations import check_migration_needed, migrate_add_mercadopago_support, migrate_add_password_reset_support
-        try:
-            if check_migration_needed():
-                app.logger.info("Ejecutando migración de MercadoPago...")
-                if migrate_add_mercadopago_support():
-                    app.logger.info("✅ Migración de MercadoPago completada")
-                else:
-                    app.logger.error("❌ Error en migración de MercadoPago")
-        except Exception as e:
-            app.logger.warning("No se pudo verificar/aplicar migración MP: %s", e)
-
-        # Ejecutar migración de recuperación de contraseñas
+        # Fast path: si la BD ya está en SCHEMA_VERSION no importamos db_migrations
+        # ni re-ejecutamos create_schema() en cada arranque de worker.
         try:
-            app.logger.info("Ejecutando migración de recuperación de contraseñas...")
-            migrate_add_password_reset_support()
+            schema_ok = db_mod.get_schema_version() == db_mod.SCHEMA_VERSION
         except Exception as e:
-            app.logger.warning("No se pudo aplicar migración de reset de contraseñas: %s", e)
+            app.logger.warning("No se pudo leer la versión de esquema: %s", e)
+            schema_ok = False
 
-        # asegura tablas (usuarios, transacciones, seats, etc.)
-        db_mod.create_schema()
-        os.makedirs(app.config["COMPROBANTES_DIR"], exist_ok=True)
-        os.makedirs(app.config["QR_DIR"], exist_ok=True)
+        if not schema_ok:
+            _bootstrap_schema(app)
 
-        # Limpieza de holds vencidos al iniciar (opcional; deja todo más prolijo en dev)
-        try:
-            removed = db_mod.purge_expired_holds()
-            if removed:
-                app.logger.info("Limpieza inicial: eliminados %s seat_holds vencidos.", removed)
-        except Exception as e:
-            app.logger.warning("No se pudo purgar holds al inicio: %s", e)
+        for d in (app.config["COMPROBANTES_DIR"], app.config["QR_DIR"]):
+            if d not in _RUNTIME_DIRS_READY:
+                os.makedirs(d, exist_ok=True)
+                _RUNTIME_DIRS_READY.add(d)
+        # La purga de holds vencidos ya no corre en cada arranque: la hacen
+        # /reserva-asientos en cada request y el comando `flask purge-seat-holds`.
 
     # ----------------- Anticacheo de HTML (evita “sesión fantasma”) ----------------- #
     @app.after_request
@@ -208,11 +351,9 @@ def create_app() -> Flask:
         Marca solo respuestas HTML como no-cache/no-store.
         Esto ayuda a que, después de logout, el navegador no “reviva” vistas con botón atrás.
         """
-        ctype = resp.headers.get("Content-Type", "")
-        if "text/html" in ctype:
-            resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-            resp.headers["Pragma"] = "no-cache"
-            resp.headers["Expires"] = "0"
+        # mimetype ya viene parseado por Werkzeug (sin "; charset=...")
+        if resp.mimetype == "text/html":
+            resp.headers.update(_NO_STORE_HEADERS)
         return resp
 
     # ----------------- Comandos CLI útiles ----------------- #
@@ -260,22 +401,25 @@ def create_app() -> Flask:
         """
         from flask import current_app
         import time
-        from pathlib import Path
 
         days = int(os.getenv("PURGE_DAYS", "30"))
-        base = Path(current_app.config["COMPROBANTES_DIR"])
-        if not base.exists():
+        base = current_app.config["COMPROBANTES_DIR"]
+        if not os.path.isdir(base):
             print("No hay carpeta de comprobantes.")
             return
         cutoff = time.time() - days * 24 * 3600
         removed = 0
-        for f in base.glob("*.pdf"):
-            try:
-                if f.stat().st_mtime < cutoff:
-                    f.unlink(missing_ok=True)
-                    removed += 1
-            except Exception:
-                pass
+        # scandir: un solo stat por entrada (cacheado en DirEntry), sin objetos Path
+        with os.scandir(base) as it:
+            for entry in it:
+                if not entry.name.endswith(".pdf"):
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
         print(f"✔ Eliminados {removed} PDFs (> {days} días). Carpeta: {base}")
 
     @app.cli.command("purge-seat-holds")
@@ -291,6 +435,19 @@ def create_app() -> Flask:
         except Exception as e:
             print(f"✖ Error purgando holds: {e}")
 
+    @app.cli.command("purge-reset-tokens")
+    def purge_reset_tokens():
+        """
+        Elimina tokens de recuperación de contraseña vencidos o ya usados.
+        Corre cada hora vía cron (deploy/cron_cinema3d):
+            flask --app wsgi purge-reset-tokens
+        """
+        try:
+            n = db_mod.cleanup_expired_reset_tokens()
+            print(f"✔ Eliminados {n} tokens de recuperación vencidos/usados.")
+        except Exception as e:
+            print(f"✖ Error purgando tokens de recuperación: {e}")
+
     # ----------------- Logging básico ----------------- #
     if not app.debug and not app.testing:
         import logging
@@ -306,7 +463,11 @@ def create_app() -> Flask:
         handler.setLevel(logging.INFO)
         fmt = logging.Formatter("[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
         handler.setFormatter(fmt)
-        app.logger.addHandler(handler)
+        # El request solo encola el registro; un hilo del QueueListener escribe
+        # y rota el archivo, así el disco no bloquea la respuesta.
+        queue_handler = QueueHandler(queue.Queue(-1))
+        _start_log_listener(app.logger, queue_handler, handler)
+        app.logger.addHandler(queue_handler)
         app.logger.setLevel(logging.INFO)
 
     return app
@@ -2,8 +2,60 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from functools import wraps
-from flask import session, redirect, url_for, request, flash
+from functools import lru_cache, wraps
+from typing import Optional, Tuple
+
+from flask import current_app, session, redirect, url_for, request, flash
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Método explícito (no dependemos del default de la versión de Werkzeug):
+# scrypt N=2^15, r=8, p=1 → ~50-80 ms por hash, memoria acotada (~32 MiB).
+# Se puede ajustar con PASSWORD_HASH_METHOD; los hashes viejos (pbkdf2:...)
+# siguen verificando porque check_password_hash lee el método del prefijo.
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+
+
+@lru_cache(maxsize=128)
+def _cached_password_hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def hash_password(password: str) -> str:
+    """
+    Hash de contraseña con el método configurado (PASSWORD_HASH_METHOD).
+    Con PASSWORD_HASH_CACHE=1 (solo tests/fixtures) la misma contraseña
+    reutiliza el hash anterior: misma sal, por eso nunca en producción.
+    """
+    cfg = current_app.config
+    method = cfg.get("PASSWORD_HASH_METHOD") or DEFAULT_PASSWORD_HASH_METHOD
+    if cfg.get("PASSWORD_HASH_CACHE"):
+        return _cached_password_hash(password, method)
+    return generate_password_hash(password, method=method)
+
+
+def password_needs_rehash(stored: str) -> bool:
+    """
+    True si el hash guardado no usa el método configurado (p.ej. un pbkdf2
+    heredado cuando ahora se usa scrypt). Se usa para re-hashear al vuelo tras
+    un login correcto.
+    """
+    method = current_app.config.get("PASSWORD_HASH_METHOD") or DEFAULT_PASSWORD_HASH_METHOD
+    prefix = (stored or "").split("$", 1)[0]
+    # "scrypt" a secas acepta cualquier "scrypt:N:r:p" que genere Werkzeug.
+    return prefix != method and not prefix.startswith(method + ":")
+
+
+def verify_and_update(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica la contraseña y, si es correcta pero el hash usa otro método,
+    devuelve también el hash nuevo para guardarlo (rehash on verify).
+    Retorna (ok, nuevo_hash_o_None).
+    """
+    ok = check_password_hash(stored, password)
+    if ok and password_needs_rehash(stored):
+        return True, hash_password(password)
+    return ok, None
+
 
 def login_required(view):
     """
@@ -13,7 +13,7 @@ Rutas administrativas protegidas que solo pueden acceder usuarios con rol 'admin
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from app.blueprints.auth import require_admin, current_user
 import app.db as db_mod
-from werkzeug.security import generate_password_hash
+from app.auth_utils import hash_password
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -29,68 +29,45 @@ def funciones():
         # Obtener parámetro para mostrar todas o solo futuras
         mostrar_todas = request.args.get('todas', 'false').lower() == 'true'
         
-        # Obtener funciones desde la base de datos
-        from datetime import datetime, date
-        
-        if mostrar_todas:
-            # Mostrar todas las funciones
-            funciones_db = db_mod.query_all("""
-                SELECT id, pelicula_id, titulo, genero, duracion, clasificacion,
-                       poster, descripcion, fecha, hora, sala, precio, asientos_disponibles
-                FROM funciones
-                ORDER BY fecha DESC, hora DESC
-            """)
-        else:
-            # Solo funciones futuras (desde ayer para incluir funciones de hoy)
-            funciones_db = db_mod.query_all("""
-                SELECT id, pelicula_id, titulo, genero, duracion, clasificacion,
-                       poster, descripcion, fecha, hora, sala, precio, asientos_disponibles
+        # El estado (past/active/upcoming) lo calcula SQLite con la fecha local,
+        # así no parseamos cada fila en Python.
+        where = "" if mostrar_todas else "WHERE fecha >= date('now', '-1 day')"  # desde ayer para incluir las de hoy
+        order = "ORDER BY fecha DESC, hora DESC" if mostrar_todas else "ORDER BY fecha, hora"
+        status_sql = """
+            CASE WHEN fecha < date('now', 'localtime') THEN 'past'
+                 WHEN fecha = date('now', 'localtime') THEN 'active'
+                 ELSE 'upcoming' END
+        """
+
+        # Filas + contadores en un solo round-trip: el CTE calcula el estado y
+        # las funciones de ventana agregan los totales sobre el mismo conjunto.
+        rows = db_mod.query_all(f"""
+            WITH f AS (
+                SELECT id, titulo, genero, duracion, fecha, hora, sala, precio, poster,
+                       {status_sql} AS status
                 FROM funciones
-                WHERE fecha >= date('now', '-1 day')
-                ORDER BY fecha, hora
-            """)
-        
-        funciones_data = []
-        for funcion in funciones_db:
-            # Determinar el estado de la función
-            fecha_funcion = datetime.strptime(funcion['fecha'], '%Y-%m-%d').date()
-            hoy = date.today()
-            
-            if fecha_funcion < hoy:
-                status = 'past'
-            elif fecha_funcion == hoy:
-                status = 'active'
-            else:
-                status = 'upcoming'
-            
-            funciones_data.append({
-                'id': funcion['id'],  # Usar el ID numérico de la base de datos
-                'titulo': funcion['titulo'],
-                'genero': funcion['genero'],
-                'duracion': funcion['duracion'],
-                'fecha': funcion['fecha'],
-                'hora': funcion['hora'],
-                'sala': funcion['sala'],
-                'precio': funcion['precio'],
-                'poster': funcion['poster'],
-                'status': status
-            })
-        
-        # Calcular estadísticas
-        total = len(funciones_data)
-        activas = len([f for f in funciones_data if f['status'] == 'active'])
-        proximas = len([f for f in funciones_data if f['status'] == 'upcoming'])
-        pasadas = len([f for f in funciones_data if f['status'] == 'past'])
-        
+                {where}
+            )
+            SELECT f.*,
+                   COUNT(*)                  OVER () AS n_total,
+                   SUM(status = 'active')    OVER () AS n_activas,
+                   SUM(status = 'upcoming')  OVER () AS n_proximas,
+                   SUM(status = 'past')      OVER () AS n_pasadas
+            FROM f
+            {order}
+        """)
+
+        # Calcular estadísticas (sin filas, todo en 0)
+        first = rows[0] if rows else None
         stats = {
-            'total': total,
-            'activas': activas,
-            'proximas': proximas,
-            'pasadas': pasadas
+            'total': first['n_total'] if first else 0,
+            'activas': first['n_activas'] if first else 0,
+            'proximas': first['n_proximas'] if first else 0,
+            'pasadas': first['n_pasadas'] if first else 0
         }
         
         return render_template("admin/funciones.html", 
-                             funciones=funciones_data, 
+                             funciones=rows,  # sqlite3.Row: Jinja lee f.titulo por clave
                              stats=stats, 
                              mostrar_todas=mostrar_todas)
     except Exception as e:
@@ -245,28 +222,23 @@ def nuevo_usuario():
         def safe_strip(value):
             return value.strip() if value else None
         
-        # Guardar el rol antes de crear el diccionario de datos
-        rol = request.form.get('rol', 'usuario')
-        
         data = {
             'nombre': safe_strip(request.form.get('nombre')) or '',
             'apellido': safe_strip(request.form.get('apellido')) or '',
             'tipo_documento': request.form.get('tipo_documento', 'DNI'),
             'nro_documento': safe_strip(request.form.get('nro_documento')) or 'temp_' + str(abs(hash(request.form.get('email', '')))),
             'email': safe_strip(request.form.get('email')) or None,
-            'contrasena_hash': generate_password_hash(request.form.get('password') or ''),
+            'contrasena_hash': hash_password(request.form.get('password') or ''),
             'telefono': safe_strip(request.form.get('telefono')),
             'ciudad': safe_strip(request.form.get('ciudad')),
             'provincia': safe_strip(request.form.get('provincia')),
             'direccion': safe_strip(request.form.get('direccion')),
-            'codigo_postal': safe_strip(request.form.get('codigo_postal'))
+            'codigo_postal': safe_strip(request.form.get('codigo_postal')),
+            'rol': request.form.get('rol', 'usuario')
         }
         
-        # Crear el usuario sin el rol
-        user_id = db_mod.upsert_usuario(**data)
-        
-        # Actualizar el rol después de crear el usuario
-        db_mod.execute("UPDATE usuarios SET rol = ? WHERE id = ?", [rol, user_id], commit=True)
+        # Crear el usuario (el rol va en el mismo INSERT/UPDATE)
+        db_mod.upsert_usuario(**data)
         
         flash("Usuario creado exitosamente", "success")
         return redirect(url_for('admin.usuarios'))
@@ -279,7 +251,13 @@ def nuevo_usuario():
 @require_admin()
 def editar_usuario(user_id):
     """Editar un usuario existente"""
-    usuario = db_mod.query_one("SELECT * FROM usuarios WHERE id = ?", [user_id])
+    # Solo las columnas que usa el formulario (sin el hash de contraseña);
+    # la fila llega como sqlite3.Row, que la plantilla lee por clave.
+    usuario = db_mod.query_one("""
+        SELECT id, nombre, apellido, tipo_documento, nro_documento, email, rol,
+               telefono, direccion, ciudad, provincia, codigo_postal
+        FROM usuarios WHERE id = ?
+    """, [user_id])
     
     if not usuario:
         flash("Usuario no encontrado", "error")
@@ -294,11 +272,16 @@ def editar_usuario(user_id):
         def safe_strip(value):
             return value.strip() if value else None
         
-        # Actualizar datos básicos
+        # Si hay nueva contraseña, va en el mismo UPDATE; NULL conserva la actual
+        nueva_contrasena = request.form.get('password')
+        password_hash = hash_password(nueva_contrasena) if nueva_contrasena else None
+        
+        # Actualizar datos básicos (+ contraseña opcional) en una sola sentencia
         db_mod.execute("""
             UPDATE usuarios 
             SET nombre=?, apellido=?, email=?, telefono=?, ciudad=?, 
-                provincia=?, direccion=?, codigo_postal=?, rol=?
+                provincia=?, direccion=?, codigo_postal=?, rol=?,
+                contrasena=COALESCE(?, contrasena)
             WHERE id=?
         """, [
             safe_strip(request.form.get('nombre')) or '',
@@ -310,16 +293,10 @@ def editar_usuario(user_id):
             safe_strip(request.form.get('direccion')),
             safe_strip(request.form.get('codigo_postal')),
             request.form.get('rol', 'usuario'),
+            password_hash,
             user_id
         ], commit=True)
         
-        # Si hay nueva contraseña, actualizarla
-        nueva_contrasena = request.form.get('password')
-        if nueva_contrasena:
-            password_hash = generate_password_hash(nueva_contrasena)
-            db_mod.execute("UPDATE usuarios SET contrasena_hash = ? WHERE id = ?", 
-                         [password_hash, user_id], commit=True)
-        
         flash("Usuario actualizado exitosamente", "success")
         return redirect(url_for('admin.usuarios'))
         
@@ -345,15 +322,11 @@ def eliminar_usuario(user_id):
             flash("No puedes eliminar tu propio usuario", "error")
             return redirect(url_for('admin.usuarios'))
         
-        # Primero eliminar todas las transacciones asociadas al usuario
-        db_mod.execute(
-            "DELETE FROM transacciones WHERE usuario_email = ?", 
-            [usuario['email']], 
-            commit=False
-        )
-        
-        # Luego eliminar el usuario
-        db_mod.execute("DELETE FROM usuarios WHERE id = ?", [user_id], commit=True)
+        # Transacciones asociadas + usuario en una sola transacción de BD
+        # (idx_trx_email cubre el filtro por usuario_email)
+        with db_mod.transaction() as conn:
+            conn.execute("DELETE FROM transacciones WHERE usuario_email = ?", [usuario['email']])
+            conn.execute("DELETE FROM usuarios WHERE id = ?", [user_id])
         
         flash("Usuario y sus transacciones eliminados exitosamente", "success")
         
@@ -371,12 +344,18 @@ def eliminar_usuario(user_id):
 def dashboard():
     """Panel de control administrativo"""
     try:
-        # Estadísticas básicas
+        # Estadísticas básicas (una sola consulta con sub-selects escalares)
+        row = db_mod.query_one("""
+            SELECT (SELECT COUNT(*) FROM usuarios)                        AS total_usuarios,
+                   (SELECT COUNT(*) FROM transacciones)                   AS total_transacciones,
+                   (SELECT COUNT(*) FROM funciones)                       AS total_funciones,
+                   (SELECT COALESCE(SUM(monto_cents), 0) FROM transacciones) AS ingresos_cents
+        """)
         stats = {
-            'total_usuarios': db_mod.query_one("SELECT COUNT(*) as count FROM usuarios")['count'],
-            'total_transacciones': db_mod.query_one("SELECT COUNT(*) as count FROM transacciones")['count'],
-            'total_funciones': db_mod.query_one("SELECT COUNT(*) as count FROM funciones")['count'],
-            'ingresos_total': db_mod.query_one("SELECT COALESCE(SUM(monto_cents), 0) as total FROM transacciones")['total'] / 100
+            'total_usuarios': row['total_usuarios'],
+            'total_transacciones': row['total_transacciones'],
+            'total_funciones': row['total_funciones'],
+            'ingresos_total': row['ingresos_cents'] / 100
         }
         
         # Últimas transacciones
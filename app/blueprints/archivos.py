@@ -3,16 +3,25 @@
 from __future__ import annotations
 
 import os
-from flask import Blueprint, current_app, send_from_directory, abort
+from functools import lru_cache
+from flask import Blueprint, Response, current_app, send_from_directory, abort
+from werkzeug.exceptions import NotFound
+
+from app.db import get_conn
 
 bp = Blueprint("archivos", __name__)
 
-def _abs_storage_dir(rel_or_abs: str) -> str:
+@lru_cache(maxsize=8)
+def _resolve_storage_dir(base: str, rel_or_abs: str) -> str:
     if os.path.isabs(rel_or_abs):
         return rel_or_abs
-    base = getattr(current_app, "root_path", os.getcwd())
     return os.path.join(base, rel_or_abs)
 
+def _abs_storage_dir(rel_or_abs: str) -> str:
+    # Invariante por proceso: se resuelve una vez por (root_path, COMPROBANTES_DIR)
+    base = getattr(current_app, "root_path", os.getcwd())
+    return _resolve_storage_dir(base, rel_or_abs)
+
 @bp.get("/comprobante/<int:trx_id>/descargar")
 def descargar_comprobante(trx_id: int):
     """
@@ -22,10 +31,40 @@ def descargar_comprobante(trx_id: int):
     filename = f"comprobante_trx_{trx_id}.pdf"
     rel_dir = current_app.config.get("COMPROBANTES_DIR", "static/comprobantes")
     directory = _abs_storage_dir(rel_dir)
-    file_path = os.path.join(directory, filename)
 
-    if not os.path.exists(file_path):
-        abort(404, description="Comprobante no encontrado")
+    # El PDF lo genera en segundo plano el worker que atendió mp_success (que
+    # puede no ser este). Estado compartido: el archivo en disco aparece recién
+    # completo (pdfs.py escribe a un temporal y renombra). Si todavía no está y
+    # la transacción fue aprobada, se está generando: pedir reintento en vez de
+    # bloquear un hilo esperándolo.
+    if not os.path.isfile(os.path.join(directory, filename)):
+        row = get_conn().execute(
+            "SELECT estado FROM transacciones WHERE id = ?", (trx_id,)
+        ).fetchone()
+        if row is None or row["estado"] != "APROBADO":
+            abort(404, description="Comprobante no encontrado")
+        return Response(
+            '<!doctype html><meta charset="utf-8"><meta http-equiv="refresh" content="3">'
+            "<p>Generando el comprobante… esta página se actualiza sola.</p>",
+            status=202,
+            content_type="text/html; charset=utf-8",
+            headers={"Retry-After": "3", "Cache-Control": "no-store"},
+        )
 
-    # Forzar descarga
-    return send_from_directory(directory=directory, path=filename, as_attachment=True)
+    # Producción: nginx sirve el archivo; el worker no lee ni un byte del PDF.
+    if current_app.config.get("USE_X_ACCEL"):
+        prefix = current_app.config.get("X_ACCEL_COMPROBANTES_PREFIX", "/_protected/comprobantes/")
+        return Response(
+            status=200,
+            content_type="application/pdf",
+            headers={
+                "X-Accel-Redirect": prefix + filename,
+                "Content-Disposition": f'attachment; filename="{filename}"',
+            },
+        )
+
+    # send_from_directory valida la ruta y levanta NotFound. Forzar descarga
+    try:
+        return send_from_directory(directory=directory, path=filename, as_attachment=True)
+    except NotFound:
+        abort(404, description="Comprobante no encontrado")
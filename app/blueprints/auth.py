@@ -20,14 +20,20 @@ Integra con la sesión:
 
 Dependencias:
 - app/db.py  -> query_one, execute, upsert_usuario
-- werkzeug.security -> generate_password_hash, check_password_hash
-- Plantillas: templates/login.html, templates/registro.html, templates/forgot_password.html, templates/reset_password.html
+- app/auth_utils.py -> hash_password, verify_and_update
+- app/service/emailer.py -> enviar_ticket, en el pool "email" de app/service/background.py
+- Plantillas: templates/login.html, templates/registro.html, templates/forgot_password.html, templates/reset_password.html,
+  templates/emails/password_reset.txt
 """
 
 from __future__ import annotations
 
+import hashlib
+import operator
 import re
 import sqlite3
+import types
+from functools import wraps
 from typing import Optional, Tuple, Dict, List
 
 from flask import (
@@ -42,7 +48,12 @@ from flask import (
     make_response,  # <- para borrar cookies en logout
 )
 
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+
+from app.extensions import get_remote_address, rate_limit
+from app.service import background
+from app.service.emailer import enviar_ticket
+from app.auth_utils import DEFAULT_PASSWORD_HASH_METHOD, hash_password, verify_and_update
 
 # Usamos el módulo de DB de la app, para tener acceso a sus helpers
 from app import db as db_mod
@@ -55,10 +66,32 @@ bp = Blueprint("auth", __name__)
 # ---------------------------------------------------------------------
 
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_DNI_LOGIN_RE = re.compile(r"\d{6,12}")
+_DNI_REG_RE = re.compile(r"\d{7,12}")
+
+# Hash descartable: si el usuario no existe (o no tiene contraseña) se verifica
+# igual contra este valor, para que el tiempo de respuesta no revele si la
+# cuenta existe.
+_DUMMY_HASH = generate_password_hash("x" * 16, method=DEFAULT_PASSWORD_HASH_METHOD)
+_LOGIN_ERROR = "Credenciales inválidas."
+
+# Campos del INSERT de registro() en orden de columnas; la contraseña
+# hasheada va entre nro_documento y direccion (ver registro()).
+_REG_FIELDS = operator.itemgetter(
+    "nombre", "apellido", "tipo_documento", "nro_documento",
+    "direccion", "ciudad", "provincia", "codigo_postal", "telefono", "email",
+)
+
+# Default inmutable para el prefill: evita crear un {} por cada GET /login.
+_EMPTY_AUTOFILL = types.MappingProxyType({})
 
 
 def _is_email(value: str) -> bool:
-    return bool(value) and EMAIL_RE.match(value.strip().lower()) is not None
+    if not value or "@" not in value:
+        # Prefiltro barato: un DNI (caso habitual en login) no llega al regex.
+        return False
+    # El valor ya llega normalizado (_norm_email / _validate_login_form).
+    return EMAIL_RE.match(value) is not None
 
 
 def _norm_email(value: Optional[str]) -> Optional[str]:
@@ -69,48 +102,91 @@ def _norm_email(value: Optional[str]) -> Optional[str]:
 
 
 def _is_dni_like(value: str) -> bool:
-    return bool(value) and re.fullmatch(r"\d{6,12}", value.strip()) is not None
+    return bool(value) and _DNI_LOGIN_RE.fullmatch(value.strip()) is not None
+
+
+# URLs de endpoints sin parámetros, resueltas una vez por script_root
+# (la app puede montarse bajo un prefijo detrás del proxy).
+_STATIC_URLS: Dict[Tuple[str, str], str] = {}
+
+
+def _static_url(endpoint: str) -> str:
+    """url_for(endpoint) memoizado para endpoints sin variables."""
+    key = (request.script_root, endpoint)
+    url = _STATIC_URLS.get(key)
+    if url is None:
+        url = _STATIC_URLS[key] = url_for(endpoint)
+    return url
+
+
+# Prefijo absoluto de /reset-password/<token> por (base, script_root). Acotado:
+# sin PUBLIC_BASE_URL la base sale del Host del request.
+_RESET_URL_PREFIX: Dict[Tuple[str, str], str] = {}
+
+
+def _reset_url_prefix() -> str:
+    """
+    Prefijo absoluto de la URL de reset (se le concatena el token, que por ser
+    token_urlsafe no necesita escaparse). Requiere request context.
+    """
+    base = current_app.config.get("PUBLIC_BASE_URL") or request.host_url
+    key = (base, request.script_root)
+    prefix = _RESET_URL_PREFIX.get(key)
+    if prefix is None:
+        if len(_RESET_URL_PREFIX) >= 32:
+            _RESET_URL_PREFIX.clear()
+        path = url_for("auth.reset_password", token="_")[:-1]
+        prefix = _RESET_URL_PREFIX[key] = base.rstrip("/") + path
+    return prefix
 
 
 def _safe_next(next_path: Optional[str]) -> Optional[str]:
     """
     Permite solo rutas locales que comiencen con '/'. Evita open redirects.
     """
-    if not next_path:
+    # Sin strip(): un next con espacios delante (p.ej. "\t//evil.com") se
+    # rechaza en vez de "arreglarse". "/\" también cuenta como protocol-relative.
+    if not next_path or next_path[0] != "/":
         return None
-    next_path = next_path.strip()
-    if next_path.startswith("/") and not next_path.startswith("//"):
-        return next_path
-    return None
+    if len(next_path) > 1 and next_path[1] in "/\\":
+        return None
+    return next_path
 
 
-def _find_user_by_login(login_id: str) -> Optional[dict]:
+def _find_user_by_login(login_id: str) -> Optional[sqlite3.Row]:
     """
     Busca el usuario por email (case-insensitive) o por nro_documento.
-    Devuelve dict con campos relevantes o None.
+    `login_id` ya viene normalizado por _validate_login_form.
+    Siempre es una sola consulta indexada: el tipo (email/DNI) se decide en Python.
+    Devuelve la fila (sqlite3.Row) o None.
+
+    La fila (hash y rol) no se cachea: con varios workers un cache por proceso
+    seguiría aceptando la contraseña/rol viejos después de un reset o un
+    cambio desde admin en otro worker.
     """
     if _is_email(login_id):
-        row = db_mod.query_one(
-            "SELECT id, nombre, apellido, email, nro_documento, contrasena, rol FROM usuarios WHERE lower(email)=lower(?)",
-            [login_id.strip().lower()],
-        )
-    else:
-        # asumimos DNI
-        row = db_mod.query_one(
-            "SELECT id, nombre, apellido, email, nro_documento, contrasena, rol FROM usuarios WHERE nro_documento = ?",
-            [login_id.strip()],
+        # lower(email) = ? usa idx_usuarios_email_lower; el parámetro ya está en minúsculas.
+        return db_mod.query_one(
+            "SELECT id, nombre, apellido, email, nro_documento, contrasena, rol FROM usuarios WHERE lower(email) = ? LIMIT 1",
+            [login_id],
         )
-
-    return db_mod.row_to_dict(row)
+    # asumimos DNI
+    return db_mod.query_one(
+        "SELECT id, nombre, apellido, email, nro_documento, contrasena, rol FROM usuarios WHERE nro_documento = ? LIMIT 1",
+        [login_id],
+    )
 
 
 def _validate_login_form(form) -> Tuple[List[str], str, str]:
     """
     Valida login: login_id + password.
-    Retorna: (errores, login_id, password)
+    Retorna: (errores, login_id, password); login_id sale normalizado
+    (emails en minúsculas) para no repetir el trabajo más abajo.
     """
     errores: List[str] = []
     login_id = (form.get("login_id") or "").strip()
+    if "@" in login_id:
+        login_id = login_id.lower()
     password = form.get("password") or ""
 
     if not login_id:
@@ -121,10 +197,21 @@ def _validate_login_form(form) -> Tuple[List[str], str, str]:
     return errores, login_id, password
 
 
-def _validate_registro_form(form) -> Tuple[List[str], Dict[str, Optional[str]]]:
+_TIPOS_DOCUMENTO = frozenset({"DNI", "CI", "LE", "LC"})
+
+
+def _validate_registro_form(
+    form,
+    _query_all=db_mod.query_all,
+    _dni_fullmatch=_DNI_REG_RE.fullmatch,
+    _is_email=_is_email,
+    _norm_email=_norm_email,
+    _TIPOS=_TIPOS_DOCUMENTO,
+) -> Tuple[List[str], Dict[str, Optional[str]]]:
     """
     Valida el formulario de registro y devuelve (errores, datos_normalizados).
     No inserta ni actualiza DB; solo valida.
+    Los argumentos con "_" son globals ligados como locales (LOAD_FAST); no pasarlos.
     """
     errores: List[str] = []
 
@@ -145,30 +232,33 @@ def _validate_registro_form(form) -> Tuple[List[str], Dict[str, Optional[str]]]:
         errores.append("El nombre debe tener al menos 2 caracteres.")
     if len(apellido) < 2:
         errores.append("El apellido debe tener al menos 2 caracteres.")
-    if tipo_documento not in {"DNI", "CI", "LE", "LC"}:
+    if tipo_documento not in _TIPOS:
         errores.append("Tipo de documento inválido.")
-    if not re.fullmatch(r"\d{7,12}", nro_documento):
+    if not _dni_fullmatch(nro_documento):
         errores.append("El número de documento debe ser numérico (7-12 dígitos).")
     if len(contrasena) < 6:
         errores.append("La contraseña debe tener al menos 6 caracteres.")
     if email and not _is_email(email):
         errores.append("Email inválido.")
 
-    # Evitar duplicados obvios (DNI o email ya usados)
+    # Evitar duplicados obvios (DNI o email ya usados) en una sola consulta.
+    # Es solo una ayuda de UX: los índices únicos + IntegrityError en registro()
+    # siguen siendo el control definitivo.
     if not errores:
-        row = db_mod.query_one(
-            "SELECT id FROM usuarios WHERE nro_documento = ?",
-            [nro_documento],
-        )
-        if row:
+        if email:
+            rows = _query_all(
+                "SELECT nro_documento, lower(email) AS email FROM usuarios "
+                "WHERE nro_documento = ? OR lower(email) = ? LIMIT 2",
+                [nro_documento, email],
+            )
+        else:
+            rows = _query_all(
+                "SELECT nro_documento, NULL AS email FROM usuarios WHERE nro_documento = ? LIMIT 1",
+                [nro_documento],
+            )
+        if any(r["nro_documento"] == nro_documento for r in rows):
             errores.append("El documento ya está registrado.")
-
-    if not errores and email:
-        row = db_mod.query_one(
-            "SELECT id FROM usuarios WHERE lower(email) = lower(?)",
-            [email],
-        )
-        if row:
+        elif email and any(r["email"] == email for r in rows):
             errores.append("El email ya está registrado.")
 
     data = {
@@ -187,25 +277,27 @@ def _validate_registro_form(form) -> Tuple[List[str], Dict[str, Optional[str]]]:
     return errores, data
 
 
-def _login_user(user: dict) -> None:
+def _login_user(user) -> None:
     """
     Rellena la sesión con datos del usuario para uso por el resto de la app.
+    `user` es una sqlite3.Row o un dict con las mismas claves (solo acceso por clave).
     """
-    session["user"] = {
-        "id": user["id"],
-        "nombre": user.get("nombre") or "",
-        "apellido": user.get("apellido") or "",
-        "email": user.get("email"),
-        "nro_documento": user.get("nro_documento"),
-        "rol": user.get("rol") or "usuario",
-    }
-    session["user_autofill"] = {
-        "nombre": user.get("nombre") or "",
-        "apellido": user.get("apellido") or "",
-        "email": user.get("email") or "",
-    }
+    session.update({
+        "user": {
+            "id": user["id"],
+            "nombre": user["nombre"] or "",
+            "apellido": user["apellido"] or "",
+            "email": user["email"],
+            "nro_documento": user["nro_documento"],
+            "rol": user["rol"] or "usuario",
+        },
+        "user_autofill": {
+            "nombre": user["nombre"] or "",
+            "apellido": user["apellido"] or "",
+            "email": user["email"] or "",
+        },
+    })
     session.permanent = True  # respeta PERMANENT_SESSION_LIFETIME
-    session.modified = True
 
 
 # ---------------------------------------------------------------------
@@ -218,11 +310,11 @@ def login():
     Login por email o DNI + contraseña.
     Soporta 'next' en querystring/form para redirigir a una ruta local.
     """
-    next_url = _safe_next(request.args.get("next")) or _safe_next(request.form.get("next")) or None
+    next_url = _safe_next(request.values.get("next"))
 
     if request.method == "GET":
         # Prefill opcional
-        ua = session.get("user_autofill", {})
+        ua = session.get("user_autofill") or _EMPTY_AUTOFILL
         return render_template(
             "login.html",
             errores=None,
@@ -236,14 +328,22 @@ def login():
         return render_template("login.html", errores=errores, login_id=login_id, next=next_url), 400
 
     user = _find_user_by_login(login_id)
-    if not user:
-        return render_template("login.html", errores=["Usuario no encontrado."], login_id=login_id, next=next_url), 400
-
-    if not user.get("contrasena"):
-        return render_template("login.html", errores=["Usuario sin contraseña. Contactá al administrador."], login_id=login_id, next=next_url), 400
-
-    if not check_password_hash(user["contrasena"], password):
-        return render_template("login.html", errores=["Contraseña incorrecta."], login_id=login_id, next=next_url), 400
+    stored = user["contrasena"] if user and user["contrasena"] else _DUMMY_HASH
+    valid, new_hash = verify_and_update(password, stored)
+    ok = int(valid) & int(stored is not _DUMMY_HASH)
+    if not ok:
+        return render_template("login.html", errores=[_LOGIN_ERROR], login_id=login_id, next=next_url), 400
+
+    # Rehash on verify: migra hashes viejos al método configurado sin forzar
+    # un reseteo de contraseña.
+    if new_hash:
+        try:
+            db_mod.execute(
+                "UPDATE usuarios SET contrasena = ? WHERE id = ?",
+                [new_hash, user["id"]],
+            )
+        except sqlite3.Error as e:
+            current_app.logger.warning("No se pudo re-hashear la contraseña de %s: %s", user["id"], e)
 
     _login_user(user)
 
@@ -253,11 +353,11 @@ def login():
 
     # Si está en medio del flujo de compra, vuelve a asientos/confirmación.
     if session.get("seats"):
-        return redirect(url_for("venta.confirmacion"))
+        return redirect(_static_url("venta.confirmacion"))
     if session.get("movie_selection"):
-        return redirect(url_for("venta.reserva_asientos"))
+        return redirect(_static_url("venta.reserva_asientos"))
 
-    return redirect(url_for("main.bienvenida"))
+    return redirect(_static_url("main.bienvenida"))
 
 
 @bp.get("/logout")
@@ -265,16 +365,9 @@ def logout():
     """
     Cierra sesión y limpia datos relevantes (usuario + flujo de compra) y cookies.
     """
-    # Claves que queremos asegurarnos de borrar (login + compra)
-    for k in (
-        "user", "user_autofill", "checkout_email", "seats", "movie_selection",
-        "combos", "hold_token", "trx_id_mp"
-    ):
-        session.pop(k, None)
-
-    # Limpieza total y cookies
+    # Limpieza total (login + compra) y cookies
     session.clear()
-    resp = make_response(redirect(url_for("main.bienvenida")))
+    resp = make_response(redirect(_static_url("main.bienvenida")))
     # Borra cookies típicas de sesión/remember (si existieran)
     resp.delete_cookie("session")
     resp.delete_cookie("remember_token")
@@ -289,7 +382,7 @@ def registro():
     Registro de usuario. Inserta nuevo usuario (si el DNI/email no existen).
     Tras registrarse, inicia sesión y redirige según el flujo.
     """
-    next_url = _safe_next(request.args.get("next")) or _safe_next(request.form.get("next")) or None
+    next_url = _safe_next(request.values.get("next"))
 
     if request.method == "GET":
         # Mostrar botón "Ir a reserva de asientos" si ya hay selección de función
@@ -318,33 +411,28 @@ def registro():
         return render_template("registro.html", errores=errores, exito=None, **data), 400
 
     # Hash de contraseña
-    pwd_hash = generate_password_hash(data["contrasena"])
+    pwd_hash = hash_password(data["contrasena"])
+    campos = _REG_FIELDS(data)
 
-    # Insertar (no usamos upsert_usuario para NO sobrescribir contraseñas existentes)
+    # Insertar (no usamos upsert_usuario para NO sobrescribir contraseñas existentes).
+    # ON CONFLICT DO NOTHING + RETURNING: el id sale del propio INSERT y un
+    # duplicado que se coló tras la validación devuelve None en vez de excepción.
     try:
-        user_id = db_mod.execute(
+        row = db_mod.query_one(
             """
             INSERT INTO usuarios
                 (nombre, apellido, tipo_documento, nro_documento, contrasena,
                  direccion, ciudad, provincia, codigo_postal, telefono, email)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            RETURNING id
             """,
-            [
-                data["nombre"],
-                data["apellido"],
-                data["tipo_documento"],
-                data["nro_documento"],
-                pwd_hash,
-                data["direccion"],
-                data["ciudad"],
-                data["provincia"],
-                data["codigo_postal"],
-                data["telefono"],
-                data["email"],
-            ],
-            commit=True,
+            (*campos[:4], pwd_hash, *campos[4:]),
         )
+        user_id = row["id"] if row else None
     except sqlite3.IntegrityError:
+        user_id = None
+    if user_id is None:
         # Índice único en nro_documento/email
         return render_template(
             "registro.html",
@@ -373,10 +461,10 @@ def registro():
     if session.get("movie_selection"):
         # Si estaba en el flujo de compra, continúe a seleccionar asientos o confirmación
         if session.get("seats"):
-            return redirect(url_for("venta.confirmacion"))
-        return redirect(url_for("venta.reserva_asientos"))
+            return redirect(_static_url("venta.confirmacion"))
+        return redirect(_static_url("venta.reserva_asientos"))
 
-    return redirect(url_for("main.bienvenida"))
+    return redirect(_static_url("main.bienvenida"))
 
 
 # =======================================================================
@@ -402,10 +490,10 @@ def is_admin():
 def require_login():
     """Decorador que requiere que el usuario esté logueado"""
     def decorator(f):
-        from functools import wraps
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not is_logged_in():
+            # Igual que is_logged_in(), sin el salto extra de funciones.
+            if session.get("user") is None:
                 return redirect(url_for('auth.login', next=request.url))
             return f(*args, **kwargs)
         return decorated_function
@@ -415,14 +503,15 @@ def require_login():
 def require_admin():
     """Decorador que requiere que el usuario sea administrador"""
     def decorator(f):
-        from functools import wraps
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not is_logged_in():
+            # Igual que is_logged_in()/is_admin(), leyendo la sesión una sola vez.
+            user = session.get("user")
+            if user is None:
                 return redirect(url_for('auth.login', next=request.url))
-            if not is_admin():
+            if user.get("rol") != "admin":
                 flash("No tienes permisos para acceder a esta sección.", "error")
-                return redirect(url_for('main.bienvenida'))
+                return redirect(_static_url('main.bienvenida'))
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -432,7 +521,34 @@ def require_admin():
 # Password Recovery Routes
 # =======================================================================
 
+def _limit_digest(value: str) -> str:
+    """Hash corto para claves del rate limit: no deja emails/DNIs ni tokens en Redis."""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def _forgot_limit_key() -> str:
+    """Clave del límite de forgot_password: el identificador pedido o, si no hay, la IP."""
+    # Misma normalización que forgot_password(): emails en minúsculas, DNI tal cual
+    login_id = (request.form.get("login_id") or "").strip()
+    if "@" in login_id:
+        login_id = login_id.lower()
+    return f"rl:forgot:{_limit_digest(login_id)}" if login_id else f"rl:forgot-ip:{get_remote_address()}"
+
+
+def _forgot_ip_limit_key() -> str:
+    """Clave del límite por IP de forgot_password: acota el barrido de identificadores."""
+    return f"rl:forgot-ip:{get_remote_address()}"
+
+
+def _reset_limit_key() -> str:
+    """Clave del límite de reset_password: IP + hash del token."""
+    token = (request.view_args or {}).get("token") or ""
+    return f"rl:reset:{get_remote_address()}:{_limit_digest(token)}"
+
+
 @bp.route("/forgot-password", methods=["GET", "POST"])
+@rate_limit("5/minute;20/hour", key_func=_forgot_limit_key, methods=["POST"])
+@rate_limit("10/minute;50/hour", key_func=_forgot_ip_limit_key, methods=["POST"])
 def forgot_password():
     """
     Formulario para solicitar recuperación de contraseña.
@@ -443,6 +559,8 @@ def forgot_password():
 
     # POST
     login_id = (request.form.get("login_id") or "").strip()
+    if "@" in login_id:
+        login_id = login_id.lower()
     
     if not login_id:
         return render_template(
@@ -455,74 +573,47 @@ def forgot_password():
     # Buscar usuario por email o DNI
     user = _find_user_by_login(login_id)
     
-    if not user:
-        # Por seguridad, no revelamos si el usuario existe o no
-        return render_template(
-            "forgot_password.html",
-            errores=None,
-            exito="Si el email o DNI está registrado, recibirás instrucciones para recuperar tu contraseña.",
-            login_id=""
+    # Misma respuesta y mismo trabajo en el request exista o no la cuenta (o
+    # tenga o no email): el token y el SMTP van en segundo plano, así el tiempo
+    # de respuesta no permite enumerar usuarios.
+    if user and user["email"]:
+        background.submit(
+            "email", _send_password_reset,
+            user["id"], user["nombre"], user["apellido"], user["email"], _reset_url_prefix(),
         )
+    elif user:
+        current_app.logger.warning("Recuperación pedida para el usuario %s, que no tiene email", user["id"])
     
-    # Verificar que el usuario tenga email
-    if not user.get("email"):
-        return render_template(
-            "forgot_password.html",
-            errores=["Tu cuenta no tiene un email asociado. Contacta al administrador."],
-            exito=None,
-            login_id=login_id
-        ), 400
+    return render_template(
+        "forgot_password.html",
+        errores=None,
+        exito="Si el email o DNI está registrado, recibirás instrucciones para recuperar tu contraseña.",
+        login_id=""
+    )
 
-    try:
-        # Crear token de recuperación
-        token = db_mod.create_password_reset_token(user["id"])
-        
-        # Enviar email
-        from app.service.emailer import enviar_ticket
-        from flask import url_for
-        
-        reset_url = url_for('auth.reset_password', token=token, _external=True)
-        
-        cuerpo = f"""
-Hola {user['nombre']} {user['apellido']},
-
-Recibimos una solicitud para restablecer la contraseña de tu cuenta en Cinema3D.
 
-Para continuar, haz clic en el siguiente enlace:
-{reset_url}
-
-Este enlace es válido por 1 hora.
-
-Si no solicitaste este cambio, puedes ignorar este mensaje.
-
-Saludos,
-Equipo Cinema3D
-        """.strip()
-        
-        enviar_ticket(
-            destino=user["email"],
-            asunto="Recuperación de contraseña - Cinema3D",
-            cuerpo=cuerpo
-        )
-        
-        return render_template(
-            "forgot_password.html",
-            errores=None,
-            exito="Si el email o DNI está registrado, recibirás instrucciones para recuperar tu contraseña.",
-            login_id=""
-        )
-        
-    except Exception as e:
-        current_app.logger.error(f"Error enviando email de recuperación: {e}")
-        return render_template(
-            "forgot_password.html",
-            errores=["Error interno. Intenta nuevamente más tarde."],
-            exito=None,
-            login_id=login_id
-        ), 500
+def _send_password_reset(user_id: int, nombre: str, apellido: str, email: str, url_prefix: str) -> None:
+    """
+    Crea el token y envía el email de recuperación. Corre en el pool "email"
+    (app context, sin request): la URL llega ya armada salvo el token.
+    """
+    token = db_mod.create_password_reset_token(user_id)
+    # Plantilla de texto plano (Jinja la compila una vez y queda en cache)
+    cuerpo = render_template(
+        "emails/password_reset.txt",
+        nombre=nombre,
+        apellido=apellido,
+        reset_url=url_prefix + token,
+    ).strip()
+    enviar_ticket(
+        destino=email,
+        asunto="Recuperación de contraseña - Cinema3D",
+        cuerpo=cuerpo,
+    )
 
 
 @bp.route("/reset-password/<token>", methods=["GET", "POST"])
+@rate_limit("5/minute", key_func=_reset_limit_key)
 def reset_password(token):
     """
     Formulario para restablecer contraseña usando un token válido.
@@ -553,20 +644,12 @@ def reset_password(token):
         return render_template("reset_password.html", token=token, errores=errores), 400
     
     try:
-        # Actualizar contraseña
-        password_hash = generate_password_hash(password)
-        db_mod.execute(
-            "UPDATE usuarios SET contrasena = ? WHERE id = ?",
-            [password_hash, user_id],
-            commit=True
-        )
-        
-        # Marcar token como usado
-        db_mod.use_password_reset_token(token)
-        
-        # Limpiar tokens expirados (mantenimiento)
-        db_mod.cleanup_expired_reset_tokens()
-        
+        # Token + contraseña en una sola transacción (un solo COMMIT)
+        password_hash = hash_password(password)
+        if db_mod.reset_password_with_token(token, password_hash) is None:
+            # Otro request lo usó (o venció) entre la validación y este POST
+            flash("El enlace de recuperación es inválido o ha expirado. Solicita uno nuevo.", "error")
+            return redirect(url_for('auth.forgot_password'))
         flash("Tu contraseña ha sido actualizada exitosamente. Ya puedes iniciar sesión.", "success")
         return redirect(url_for('auth.login'))
         
@@ -15,6 +15,10 @@ from app.data.seed import BRANCHES
 
 bp = Blueprint("main", __name__)
 
+# BRANCHES es constante: el payload del selector se arma una sola vez.
+_BRANCHES_PAYLOAD = tuple({"id": b, "nombre": b} for b in BRANCHES)
+_BRANCH_INDEX = {b["id"]: b for b in _BRANCHES_PAYLOAD}
+
 
 @bp.get("/")
 def inicio():
@@ -32,13 +36,12 @@ def bienvenida():
     - current_branch: sucursal actualmente seleccionada en sesión (si existe)
     - current_branch_id: id de la sucursal seleccionada (mismo string)
     """
-    branches = [{"id": b, "nombre": b} for b in BRANCHES]
     current_id = session.get("branch")
-    current_branch = next((b for b in branches if b["id"] == current_id), None)
+    current_branch = _BRANCH_INDEX.get(current_id)
 
     return render_template(
         "bienvenida.html",
-        branches=branches,
+        branches=_BRANCHES_PAYLOAD,
         current_branch=current_branch,
         current_branch_id=current_id,
     )
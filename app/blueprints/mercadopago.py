@@ -4,14 +4,20 @@
 Blueprint para manejar webhooks y callbacks de MercadoPago
 """
 
-import json
 import logging
 from datetime import datetime
+from decimal import Decimal
+
+try:  # orjson es opcional: parser en C, bastante más rápido que json
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as _json_loads
 from flask import Blueprint, request, jsonify, current_app, flash, redirect, url_for, session
 
 from app.service.mercadopago_service import mp_service
-from app.db import get_conn
-from app.service.emailer import enviar_ticket
+from app import db as db_mod
+from app.service import background
+from app.service.emailer import enviar_ticket_async
 from app.service.pdfs import generar_comprobante_pdf
 from app.service.qrs import generar_qr
 
@@ -31,7 +37,8 @@ def webhook_mercadopago():
             logger.warning("Webhook MP recibido sin datos JSON")
             return jsonify({"status": "error", "message": "No data"}), 400
         
-        logger.info(f"Webhook MP recibido: {json.dumps(webhook_data, indent=2)}")
+        # Logging perezoso: el dict sólo se formatea si INFO está habilitado
+        logger.info("Webhook MP recibido: %s", webhook_data)
         
         # Procesar webhook
         result = mp_service.procesar_webhook(webhook_data)
@@ -73,10 +80,10 @@ def actualizar_transaccion_desde_mp(external_reference: str, payment_info: dict)
     Returns:
         Dict con resultado de la actualización
     """
+    # Conexión del request (g.db) dentro de db_mod.transaction(): el cambio de
+    # estado y la nota de error van en un solo BEGIN/COMMIT (con
+    # isolation_level=None un conn.commit() suelto no agrupa nada).
     try:
-        conn = get_conn()
-        cursor = conn.cursor()
-        
         # Obtener información del pago
         payment = payment_info["payment"]
         mp_payment_id = payment["id"]
@@ -88,158 +95,137 @@ def actualizar_transaccion_desde_mp(external_reference: str, payment_info: dict)
         # Mapear estado de MP a estado local
         estado_local = mp_service.mapear_estado_mp_a_local(mp_status)
         
-        # Buscar la transacción local
-        cursor.execute("""
-            SELECT id, estado, email_cliente, total_pesos, funcion_id, asientos_json, combos_json
-            FROM transacciones 
-            WHERE id = %s OR external_reference = %s
-        """, (external_reference, external_reference))
-        
-        transaccion = cursor.fetchone()
-        
-        if not transaccion:
-            logger.warning(f"Transacción no encontrada: {external_reference}")
-            return {
-                "success": False,
-                "error": "Transacción no encontrada"
-            }
-        
-        trans_id, estado_actual, email_cliente, total_local, funcion_id, asientos_json, combos_json = transaccion
-        
-        # Solo actualizar si hay cambio de estado
-        if estado_actual == estado_local:
-            logger.info(f"Transacción {external_reference} ya tiene estado {estado_local}")
-            return {
-                "success": True,
-                "message": "Estado ya actualizado",
-                "no_change": True
-            }
-        
-        # Actualizar transacción
-        cursor.execute("""
-            UPDATE transacciones 
-            SET estado = %s, 
-                mp_payment_id = %s,
-                mp_status = %s,
-                mp_status_detail = %s,
-                monto_mp = %s,
-                monto_neto_mp = %s,
-                fecha_actualizacion = %s
-            WHERE id = %s
-        """, (
-            estado_local, 
-            mp_payment_id, 
-            mp_status, 
-            mp_status_detail,
-            transaction_amount,
-            net_amount,
-            datetime.now(),
-            trans_id
-        ))
-        
-        # Si el pago fue aprobado, confirmar asientos y generar comprobante
-        if estado_local == "APROBADO" and estado_actual != "APROBADO":
-            resultado_confirmacion = confirmar_pago_aprobado(
-                trans_id, 
-                funcion_id, 
-                asientos_json, 
-                combos_json,
-                email_cliente
-            )
+        confirmado = False
+        with db_mod.transaction() as conn:
+            # Un solo UPDATE ... RETURNING: sólo toca la fila si el estado cambia,
+            # así no hay ventana entre leer y escribir (webhooks duplicados de MP).
+            rows = conn.execute("""
+                UPDATE transacciones 
+                SET estado = ?, 
+                    mp_payment_id = ?,
+                    mp_status = ?,
+                    mp_status_detail = ?,
+                    monto_mp = ?,
+                    monto_neto_mp = ?,
+                    fecha_actualizacion = ?
+                WHERE (id = ? OR external_reference = ?) AND estado IS NOT ?
+                RETURNING id, usuario_email, funcion_id, asientos_json
+            """, (
+                estado_local, 
+                mp_payment_id, 
+                mp_status, 
+                mp_status_detail,
+                transaction_amount,
+                net_amount,
+                datetime.now(),
+                external_reference,
+                external_reference,
+                estado_local,
+            )).fetchall()
             
-            if not resultado_confirmacion["success"]:
-                logger.error(f"Error confirmando pago {trans_id}: {resultado_confirmacion}")
-                # No hacer rollback, mantener el estado MP pero marcar error
-                cursor.execute("""
-                    UPDATE transacciones 
-                    SET notas = %s 
-                    WHERE id = %s
-                """, (f"Error confirmando: {resultado_confirmacion['error']}", trans_id))
+            if not rows:
+                # Sin filas: o no existe, o ya tenía ese estado (camino raro, una consulta extra)
+                existe = conn.execute(
+                    "SELECT 1 FROM transacciones WHERE id = ? OR external_reference = ? LIMIT 1",
+                    (external_reference, external_reference),
+                ).fetchone()
+                if not existe:
+                    logger.warning(f"Transacción no encontrada: {external_reference}")
+                    return {
+                        "success": False,
+                        "error": "Transacción no encontrada"
+                    }
+                logger.info(f"Transacción {external_reference} ya tiene estado {estado_local}")
+                return {
+                    "success": True,
+                    "message": "Estado ya actualizado",
+                    "no_change": True
+                }
+            
+            trans_id, email_cliente, funcion_id, asientos_json = rows[0]
+            
+            # Si el pago fue aprobado, confirmar asientos
+            # (el WHERE garantiza que antes no estaba APROBADO)
+            if estado_local == "APROBADO":
+                # Se parsea una sola vez acá; confirmar_pago_aprobado recibe la lista
+                asientos = _json_loads(asientos_json) if asientos_json else []
+                resultado_confirmacion = confirmar_pago_aprobado(
+                    trans_id, 
+                    funcion_id, 
+                    asientos, 
+                    email_cliente,
+                    encolar=False,
+                )
+                confirmado = resultado_confirmacion["success"]
+                
+                if not confirmado:
+                    logger.error(f"Error confirmando pago {trans_id}: {resultado_confirmacion}")
+                    # No hacer rollback, mantener el estado MP pero marcar error
+                    conn.execute("""
+                        UPDATE transacciones 
+                        SET notas = ? 
+                        WHERE id = ?
+                    """, (f"Error confirmando: {resultado_confirmacion['error']}", trans_id))
         
-        conn.commit()
+        # QR + PDF + email recién después del COMMIT: el job corre en otra
+        # conexión y tiene que ver la transacción ya aprobada.
+        if confirmado:
+            background.submit("comprobantes", _generar_y_enviar_comprobante, trans_id, email_cliente)
         
-        logger.info(f"Transacción {external_reference} actualizada: {estado_actual} -> {estado_local}")
+        logger.info(f"Transacción {external_reference} actualizada -> {estado_local}")
         
         return {
             "success": True,
             "transaction_id": trans_id,
-            "old_status": estado_actual,
             "new_status": estado_local,
             "mp_payment_id": mp_payment_id
         }
         
     except Exception as e:
+        # transaction() ya hizo ROLLBACK
         logger.error(f"Error actualizando transacción {external_reference}: {str(e)}")
-        if 'conn' in locals():
-            conn.rollback()
         return {
             "success": False,
             "error": str(e)
         }
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-def confirmar_pago_aprobado(trans_id: int, funcion_id: int, asientos_json: str, 
-                          combos_json: str, email_cliente: str) -> dict:
+def confirmar_pago_aprobado(trans_id: int, funcion_id: int, asientos: list,
+                          email_cliente: str, encolar: bool = True) -> dict:
     """
-    Confirma un pago aprobado: confirma asientos, genera QR y PDF, envía email
+    Confirma un pago aprobado: confirma asientos en el momento y encola la
+    generación de QR/PDF y el envío del email
     
     Args:
         trans_id: ID de la transacción
         funcion_id: ID de la función
-        asientos_json: JSON con asientos seleccionados
-        combos_json: JSON con combos seleccionados  
+        asientos: asientos ya decodificados ([{"numero": ...}, ...])
         email_cliente: Email del cliente
+        encolar: encolar QR/PDF/email acá; False si el caller tiene una
+            transacción abierta y lo encola después del COMMIT
     
     Returns:
         Dict con resultado de la confirmación
     """
     try:
-        import json
-        from app.db import confirm_seats
-        
-        # Parsear asientos y combos
-        asientos = json.loads(asientos_json) if asientos_json else []
-        combos = json.loads(combos_json) if combos_json else []
-        
-        # Confirmar asientos (convertir holds a reservas definitivas)
+        # db.confirm_seats() convierte los holds de un token de sesión
+        # (token/movie_id/fecha/hora/sala); el webhook no tiene ese token, así que
+        # acá no se pueden confirmar asientos. En el flujo registrado lo hace
+        # pago.mp_success.
         if asientos:
-            asientos_nums = [asiento["numero"] for asiento in asientos]
-            confirm_result = confirm_seats(funcion_id, asientos_nums)
-            
-            if not confirm_result.get("success", True):
-                return {
-                    "success": False,
-                    "error": f"Error confirmando asientos: {confirm_result.get('error', 'Unknown')}"
-                }
-        
-        # Generar QR
-        qr_path = None
-        try:
-            qr_path = generar_qr(trans_id)
-        except Exception as e:
-            logger.warning(f"Error generando QR para transacción {trans_id}: {str(e)}")
-        
-        # Generar PDF del comprobante
-        pdf_path = None
-        try:
-            pdf_path = generar_comprobante_pdf(trans_id)
-        except Exception as e:
-            logger.warning(f"Error generando PDF para transacción {trans_id}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Confirmación de asientos sin hold token: usar pago.mp_success",
+            }
         
-        # Enviar email de confirmación
-        try:
-            if email_cliente and pdf_path:
-                enviar_ticket(email_cliente, trans_id, pdf_path)
-        except Exception as e:
-            logger.warning(f"Error enviando email para transacción {trans_id}: {str(e)}")
+        # QR + PDF + email fuera del webhook (pool "comprobantes"): MercadoPago
+        # recibe el 200 enseguida y no reintenta por timeout. Los asientos ya
+        # quedaron confirmados arriba, que es lo que no puede esperar.
+        if encolar:
+            background.submit("comprobantes", _generar_y_enviar_comprobante, trans_id, email_cliente)
         
         return {
             "success": True,
-            "qr_path": qr_path,
-            "pdf_path": pdf_path,
-            "email_sent": bool(email_cliente and pdf_path)
+            "artifacts_queued": encolar,
         }
         
     except Exception as e:
@@ -249,76 +235,130 @@ def confirmar_pago_aprobado(trans_id: int, funcion_id: int, asientos_json: str,
             "error": str(e)
         }
 
-@bp.route("/success")
-def pago_exitoso():
-    """Página de éxito después del pago en MercadoPago"""
-    collection_id = request.args.get('collection_id')
-    collection_status = request.args.get('collection_status')
-    payment_id = request.args.get('payment_id')
-    status = request.args.get('status')
-    external_reference = request.args.get('external_reference')
-    payment_type = request.args.get('payment_type')
-    merchant_order_id = request.args.get('merchant_order_id')
-    preference_id = request.args.get('preference_id')
-    site_id = request.args.get('site_id')
-    processing_mode = request.args.get('processing_mode')
-    merchant_account_id = request.args.get('merchant_account_id')
+_SQL_TRX_COMPROBANTE = """
+    SELECT pelicula, fecha_funcion, hora_funcion, sala, asientos_json, combos_json,
+           monto_cents, total_pesos, mp_payment_id
+    FROM transacciones WHERE id = ?
+"""
+
+
+def _generar_y_enviar_comprobante(trans_id: int, email_cliente: str) -> dict:
+    """
+    Genera QR y PDF del comprobante y encola el email. Corre en segundo plano
+    (app/service/background.py), con app context pero sin request: los datos
+    del comprobante se leen de la transacción ya confirmada.
+    """
+    trx = db_mod.query_one(_SQL_TRX_COMPROBANTE, [trans_id])
+    if trx is None:
+        logger.warning(f"Transacción {trans_id} no encontrada para el comprobante")
+        return {"qr_path": None, "pdf_path": None, "email_sent": False}
     
-    logger.info(f"Callback éxito MP - payment_id: {payment_id}, status: {status}, external_reference: {external_reference}")
+    asientos = [a["numero"] for a in _json_loads(trx["asientos_json"] or "[]")]
+    combos = [
+        {"nombre": c["nombre"], "cantidad": c.get("cantidad", 1), "precio": c["precio"]}
+        for c in _json_loads(trx["combos_json"] or "[]")
+    ]
+    # Centavos exactos si están; total_pesos en filas viejas
+    if trx["monto_cents"] is not None:
+        total = Decimal(trx["monto_cents"]).scaleb(-2)
+    else:
+        total = Decimal(str(trx["total_pesos"] or 0))
     
-    # Guardar información en la sesión para mostrar en el template
-    session['mp_success_data'] = {
-        'payment_id': payment_id,
-        'status': status,
-        'external_reference': external_reference,
-        'collection_status': collection_status
-    }
+    qr_path = None
+    try:
+        qr_path = generar_qr(
+            trx_id=trans_id, verify_url=None,
+            extra={"email": email_cliente, "mp_payment_id": trx["mp_payment_id"]},
+        )
+    except Exception as e:
+        logger.warning(f"Error generando QR para transacción {trans_id}: {str(e)}")
     
-    # Si tenemos external_reference, verificar el estado del pago
-    if external_reference and payment_id:
-        try:
-            payment_info = mp_service.obtener_pago(payment_id)
-            if payment_info["success"]:
-                actualizar_transaccion_desde_mp(external_reference, payment_info)
-        except Exception as e:
-            logger.error(f"Error verificando pago en callback de éxito: {str(e)}")
+    pdf_path = None
+    try:
+        pdf_path = generar_comprobante_pdf(
+            trx_id=trans_id, cliente=email_cliente or "-", email=email_cliente or "-",
+            pelicula=trx["pelicula"] or "-",
+            fecha_funcion=trx["fecha_funcion"] or "-", hora_funcion=trx["hora_funcion"] or "-",
+            sala=trx["sala"] or "-",
+            asientos=asientos,
+            combos=combos,
+            total=total,
+            sucursal=current_app.config.get("DEFAULT_BRANCH", "-"),
+            qr_path=qr_path,
+        )
+    except Exception as e:
+        logger.warning(f"Error generando PDF para transacción {trans_id}: {str(e)}")
     
-    flash("¡Pago procesado exitosamente! Recibirás un email con tu comprobante.", "success")
-    return redirect(url_for('pago_mp.pago_ok'))
-
-@bp.route("/failure")
-def pago_fallido():
-    """Página de fallo después del pago en MercadoPago"""
-    payment_id = request.args.get('payment_id')
-    status = request.args.get('status')
-    external_reference = request.args.get('external_reference')
+    try:
+        if email_cliente and pdf_path:
+            enviar_ticket_async(
+                destino=email_cliente,
+                asunto=f"Tu entrada - Transacción {trans_id}",
+                cuerpo="¡Gracias por tu compra! Adjuntamos tu comprobante.",
+                adjunto_path=pdf_path,
+            )
+    except Exception as e:
+        logger.warning(f"Error enviando email para transacción {trans_id}: {str(e)}")
     
-    logger.info(f"Callback fallo MP - payment_id: {payment_id}, status: {status}, external_reference: {external_reference}")
+    return {
+        "qr_path": qr_path,
+        "pdf_path": pdf_path,
+        "email_sent": bool(email_cliente and pdf_path)
+    }
+
+# kind -> (clave de sesión, categoría del flash, mensaje, endpoint destino)
+_CALLBACK_CFG = {
+    "success": ("mp_success_data", "success",
+                "¡Pago procesado exitosamente! Recibirás un email con tu comprobante.",
+                "pago_mp.pago_ok"),
+    "failure": ("mp_failure_data", "error",
+                "El pago no pudo ser procesado. Puedes intentar nuevamente.",
+                "pago_mp.pago_error"),
+    "pending": ("mp_pending_data", "info",
+                "Tu pago está siendo procesado. Te notificaremos cuando esté confirmado.",
+                "pago_mp.pago_pendiente"),
+}
+
+
+def _verificar_pago_callback(external_reference: str, payment_id: str) -> None:
+    """Consulta el pago en MP y actualiza la transacción (pool "mp", sin request)."""
+    try:
+        payment_info = mp_service.obtener_pago(payment_id)
+        if payment_info["success"]:
+            actualizar_transaccion_desde_mp(external_reference, payment_info)
+    except Exception as e:
+        logger.error(f"Error verificando pago en callback de éxito: {str(e)}")
+
+
+@bp.route("/<any(success, failure, pending):kind>")
+def mp_callback(kind: str):
+    """
+    Vuelta del usuario desde MercadoPago (back_urls /webhook/success|failure|pending).
+    Guarda los datos del pago en sesión, muestra el flash y redirige.
+    """
+    session_key, categoria, mensaje, destino = _CALLBACK_CFG[kind]
+    args = request.args
+    payment_id = args.get('payment_id')
+    external_reference = args.get('external_reference')
     
-    # Guardar información en la sesión
-    session['mp_failure_data'] = {
+    data = {
         'payment_id': payment_id,
-        'status': status,
-        'external_reference': external_reference
+        'status': args.get('status'),
+        'external_reference': external_reference,
     }
+    if kind == "success":
+        data['collection_status'] = args.get('collection_status')
     
-    flash("El pago no pudo ser procesado. Puedes intentar nuevamente.", "error")
-    return redirect(url_for('pago_mp.pago_error'))
-
-@bp.route("/pending")
-def pago_pendiente():
-    """Página de pago pendiente"""
-    payment_id = request.args.get('payment_id')
-    status = request.args.get('status')
-    external_reference = request.args.get('external_reference')
+    logger.info("Callback %s MP - payment_id: %s, status: %s, external_reference: %s",
+                kind, payment_id, data['status'], external_reference)
     
-    logger.info(f"Callback pendiente MP - payment_id: {payment_id}, status: {status}, external_reference: {external_reference}")
+    # Guardar información en la sesión para mostrar en el template
+    session[session_key] = data
     
-    session['mp_pending_data'] = {
-        'payment_id': payment_id,
-        'status': status,
-        'external_reference': external_reference
-    }
+    # En éxito, verificar el pago contra MP en segundo plano: el navegador no
+    # espera la API de MP (el webhook hace lo mismo de todos modos).
+    if kind == "success" and external_reference and payment_id:
+        background.submit("mp", _verificar_pago_callback, external_reference, payment_id)
     
-    flash("Tu pago está siendo procesado. Te notificaremos cuando esté confirmado.", "info")
-    return redirect(url_for('pago_mp.pago_pendiente'))
\ No newline at end of file
+    flash(mensaje, categoria)
+    return redirect(url_for(destino))
@@ -2,24 +2,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import logging
 import os
+import time
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
 from typing import List, Tuple, Dict, Any
-from urllib.parse import urljoin
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
 import json
 
+try:  # orjson es opcional: parser en C, bastante más rápido que json
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as _json_loads
+
 from flask import (
-    Blueprint, current_app, flash, redirect, render_template,
+    Blueprint, current_app, flash, g, redirect, render_template,
     request, session, url_for
 )
-import mercadopago
 
-from app.service.qrs import generar_qr
-from app.service.pdfs import generar_comprobante_pdf
-from app.service.emailer import enviar_ticket
+# mercadopago (requests), qrcode/PIL y fpdf se importan recién donde se usan:
+# son las dependencias más pesadas y sólo las necesita el checkout.
+from app.service.emailer import enviar_tickets
 from app.db import get_conn
 from app import db as db_mod
 from app.data.seed import COMBOS_CATALOG
@@ -30,42 +34,71 @@ bp = Blueprint("pago", __name__)
 def _get_mp_token() -> str:
     return (os.getenv("MP_ACCESS_TOKEN") or os.getenv("MERCADOPAGO_ACCESS_TOKEN") or "").strip()
 
+@lru_cache(maxsize=2)
+def _sdk_mp_cached(token: str):
+    # Un SDK por token y proceso; la Session HTTP debajo ya es compartida
+    from app.service import mp_http
+    return mp_http.sdk(token)
+
 def _sdk_mp():
     token = _get_mp_token()
     if not token:
         current_app.logger.error("Mercado Pago: falta MP_ACCESS_TOKEN/MERCADOPAGO_ACCESS_TOKEN")
         raise RuntimeError("Falta MP_ACCESS_TOKEN en el entorno")
-    return mercadopago.SDK(token)
+    return _sdk_mp_cached(token)
+
+def warm_mp_sdk() -> None:
+    """Construye el SDK al arrancar (si hay token) para que el primer /pago no lo pague."""
+    token = _get_mp_token()
+    if token:
+        _sdk_mp_cached(token)
+
+class _TokenMPInvalido(Exception):
+    """Fallo de validación: se lanza para que lru_cache no lo guarde."""
+
+
+@lru_cache(maxsize=4)
+def _mp_token_validate(token: str, epoch_bucket: int) -> Tuple[bool, str]:
+    # Sólo se cachean los éxitos (un resultado por token y minuto); los
+    # fallos salen por excepción y se reintentan en el próximo POST.
+    # Session compartida (keep-alive): no repite el handshake TLS en cada miss
+    from app.service import mp_http
+    import requests
+    try:
+        r = mp_http.get_session().get(
+            f"{mp_http.MP_API_BASE}/users/me",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            timeout=mp_http.DEFAULT_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise _TokenMPInvalido(f"Error de red hacia MP: {e}")
+    if r.status_code != 200:
+        raise _TokenMPInvalido(f"{r.status_code} {r.reason} {r.text}".strip())
+    return True, ""
 
 def _mp_token_ok() -> Tuple[bool, str]:
     token = _get_mp_token()
     if not token:
         return False, "Falta MP_ACCESS_TOKEN"
-    req = Request(
-        "https://api.mercadopago.com/users/me",
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    )
     try:
-        with urlopen(req, timeout=10) as r:
-            if r.status == 200:
-                return True, ""
-            return False, f"users/me devolvió status {r.status}"
-    except HTTPError as e:
-        try:
-            body = e.read().decode("utf-8")
-        except Exception:
-            body = ""
-        return False, f"{e.code} {e.reason} {body}".strip()
-    except URLError as e:
-        return False, f"Error de red hacia MP: {e.reason}"
+        return _mp_token_validate(token, int(time.time() // 60))
+    except _TokenMPInvalido as e:
+        return False, str(e)
     except Exception as e:
         return False, f"Excepción verificando token: {e}"
 
 # -------- Helpers app --------
+# Índice y precios en centavos de combos, calculados una vez (el catálogo es estático)
+_COMBOS_BY_ID = {c["id"]: c for c in COMBOS_CATALOG}
+_COMBO_CENTS = {c["id"]: int(round(c.get("precio", 0) * 100)) for c in COMBOS_CATALOG}
+
 def _combos_from_session() -> List[dict]:
-    ids = [int(x) for x in session.get("combos", [])]
-    idset = set(ids)
-    return [c for c in COMBOS_CATALOG if c["id"] in idset]
+    raw = session.get("combos")
+    if not raw:  # lo más común: combos es opcional
+        return []
+    # dict.fromkeys: sin duplicados (como el filtro anterior) y en el orden elegido
+    ids = dict.fromkeys(map(int, raw))
+    return [_COMBOS_BY_ID[i] for i in ids if i in _COMBOS_BY_ID]
 
 def _seleccion_from_session() -> dict:
     return session.get("movie_selection", {}) or {}
@@ -73,46 +106,111 @@ def _seleccion_from_session() -> dict:
 def _seats_from_session() -> List[str]:
     return session.get("seats", []) or []
 
-def _precio_entrada() -> Decimal:
-    raw = str(current_app.config.get("TICKET_PRICE", "5000"))
+@lru_cache(maxsize=8)
+def _parse_cents(raw: str) -> int:
     try:
-        return Decimal(raw)
+        return int((Decimal(raw) * 100).to_integral_value(rounding=ROUND_HALF_UP))
     except Exception:
-        return Decimal("5000")
-
-def _calcular_totales() -> Tuple[Decimal, Decimal, Decimal, list, list, dict]:
-    TWO = Decimal("0.01")
-    precio = Decimal(str(_precio_entrada()))
+        return 500000
+
+def _precio_entrada_cents() -> int:
+    # TICKET_PRICE es un string de config: se parsea una vez por valor
+    return _parse_cents(str(current_app.config.get("TICKET_PRICE", "5000")))
+
+def _calcular_totales() -> Tuple[int, int, int, list, list, dict]:
+    """
+    Totales en centavos enteros: (entradas, combos, total, combos, seats, selección).
+    Se calculan una vez por request (memo en g).
+    """
+    cached = g.get("_pago_totales")
+    if cached is not None:
+        return cached
     seats = _seats_from_session()
     combos = _combos_from_session()
     seleccion = _seleccion_from_session()
 
-    total_entradas = (precio * Decimal(len(seats))).quantize(TWO, rounding=ROUND_HALF_UP)
-    total_combos = sum(
-        (Decimal(str(c.get("precio", 0))) for c in combos),
-        Decimal("0")
-    ).quantize(TWO, rounding=ROUND_HALF_UP)
+    # Aritmética de enteros sobre, a lo sumo, un puñado de combos: no hay nada
+    # que vectorizar ni compilar (numpy/numba costarían más en llamada que esto).
+    total_entradas = _precio_entrada_cents() * len(seats)
+    total_combos = sum(_COMBO_CENTS[c["id"]] for c in combos)
+    g._pago_totales = res = (
+        total_entradas, total_combos, total_entradas + total_combos, combos, seats, seleccion
+    )
+    return res
 
-    total = (total_entradas + total_combos).quantize(TWO, rounding=ROUND_HALF_UP)
-    return total_entradas, total_combos, total, combos, seats, seleccion
+def _fmt_cents(cents: int) -> str:
+    return f"{cents // 100}.{cents % 100:02d}"
 
-def _to_cents(amount: Decimal) -> int:
-    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+def _cents_to_decimal(cents: int) -> Decimal:
+    # Exacto (sin pasar por float): para el PDF y la plantilla
+    return Decimal(cents).scaleb(-2)
 
 def _is_local(url: str) -> bool:
     # Trata http:// como local (útil en dev)
     return ("127.0.0.1" in url) or ("localhost" in url) or url.startswith("http://")
 
-def _abs_url_for(endpoint: str) -> str:
-    rel = url_for(endpoint, _external=False)
-    base = (os.getenv("PUBLIC_BASE_URL") or os.getenv("BASE_URL") or request.host_url or "").strip()
+_MP_BACK_ENDPOINTS = {
+    "success": "pago.mp_success",
+    "failure": "pago.mp_failure",
+    "pending": "pago.mp_pending",
+    "webhook": "pago.mp_webhook",
+}
+# (base, script_root) -> {"success": url, ..., "valid": bool, ...}; invariante
+# salvo que cambie el host, así que validación y flags también se calculan una vez
+_MP_BACK_URLS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+def _mp_back_urls() -> Dict[str, Any]:
+    """
+    URLs absolutas de retorno/webhook de MP, resueltas una vez por base, más:
+    "valid" (las tres back_urls son http/https), "webhook_local" y
+    "success_https".
+    """
+    base = (current_app.config.get("PUBLIC_BASE_URL") or request.host_url or "").strip()
     if base and not base.endswith("/"):
         base = base + "/"
-    return urljoin(base, rel.lstrip("/"))
+    key = (base, request.script_root)
+    urls = _MP_BACK_URLS.get(key)
+    if urls is None:
+        if len(_MP_BACK_URLS) >= 32:
+            _MP_BACK_URLS.clear()
+        urls = {
+            k: base + url_for(ep, _external=False).lstrip("/")
+            for k, ep in _MP_BACK_ENDPOINTS.items()
+        }
+        urls["valid"] = all(_valid_url(urls[k]) for k in ("success", "failure", "pending"))
+        urls["webhook_local"] = _is_local(urls["webhook"])
+        urls["success_https"] = urls["success"].startswith("https://")
+        _MP_BACK_URLS[key] = urls
+    return urls
+
+def check_mp_back_urls(app) -> None:
+    """Al arrancar: si hay PUBLIC_BASE_URL, resuelve y valida las back_urls (falla en el log, no en el primer pago)."""
+    base = app.config.get("PUBLIC_BASE_URL")
+    if not base:
+        return  # se resuelven con request.host_url en el primer POST
+    with app.test_request_context("/"):
+        urls = _mp_back_urls()
+    if not urls["valid"]:
+        app.logger.error("Back URLs de Mercado Pago inválidas con PUBLIC_BASE_URL=%s: %s", base, urls)
 
 def _valid_url(u: str) -> bool:
     return bool(u) and u.startswith(("http://", "https://"))
 
+# -------- SQL --------
+# Texto fijo por sentencia: get_conn() abre la conexión con cached_statements,
+# así cada una se prepara una vez por conexión y después sólo se re-bindea.
+_SQL_INSERT_TRX = """
+    INSERT INTO transacciones (usuario_email, monto_cents, estado, created_at, auth_code)
+    VALUES (?,?,?,?,?)
+    RETURNING id
+"""
+_SQL_UPDATE_PREF = "UPDATE transacciones SET estado=?, mp_preference_id=? WHERE id=?"
+_SQL_UPDATE_APPROVED = (
+    "UPDATE transacciones SET estado=?, brand=?, last4=?, mp_payment_id=?, fecha_actualizacion=? "
+    "WHERE id=? RETURNING monto_cents"
+)
+_SQL_MARCAR = "UPDATE transacciones SET estado=?, fecha_actualizacion=? WHERE id=?"
+
 # -------- Rutas --------
 @bp.route("/pago", methods=["GET", "POST"])
 def pago():
@@ -133,8 +231,8 @@ def pago():
             errores=None, exito=None, email=user_email,  # email viene de la sesión
             nombre_tarjeta="",
             seleccion=sel, seats=seats, combos=combos,
-            monto_sugerido=f"{total:.2f}",
-            total_entradas=t_ent, total_combos=t_combo, total=total
+            monto_sugerido=_fmt_cents(total),
+            total_entradas=t_ent / 100, total_combos=t_combo / 100, total=total / 100
         )
 
     # ---------- POST: crear preferencia ----------
@@ -145,8 +243,6 @@ def pago():
 
     # Siempre usar email de la sesión (no pedimos más el campo)
     email = user_email
-    session["checkout_email"] = email
-    session.modified = True
 
     # Pre-chequeo de token para mensaje claro si falla
     ok_token, detalle = _mp_token_ok()
@@ -156,19 +252,19 @@ def pago():
         return redirect(url_for("pago.pago"))
 
     conn = get_conn()
+    # Un solo strftime: el sufijo del auth_code (HHMMSS) sale del mismo string
     now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO transacciones (usuario_email, monto_cents, estado, created_at, auth_code)
-        VALUES (?,?,?,?,?)
-        """,
-        (email, _to_cents(total), "INICIADO", now_iso, f"MP-{datetime.now().strftime('%H%M%S')}"),
-    )
-    trx_id = int(cur.lastrowid or 0)
-    conn.commit()
-    session["trx_id_mp"] = trx_id
-    session.modified = True
+    # El id hace falta antes de hablar con MP (external_reference/metadata), así
+    # que el INSERT va primero; no abrimos una transacción que abarque la llamada
+    # HTTP porque bloquearía a los demás escritores de SQLite mientras tanto.
+    # Con isolation_level=None cada sentencia ya es su propia transacción: los
+    # conn.commit() que seguían eran no-ops.
+    trx_id = conn.execute(
+        _SQL_INSERT_TRX,
+        (email, total, "INICIADO", now_iso, "MP-" + now_iso[11:].replace(":", "")),
+    ).fetchone()[0]
+    # Una sola escritura de sesión con todo lo que necesita mp_success
+    session.update({"checkout_email": email, "trx_id_mp": trx_id})
 
     try:
         sdk = _sdk_mp()
@@ -176,15 +272,13 @@ def pago():
         flash("No se pudo iniciar el pago: error de credenciales de Mercado Pago (ver logs).", "danger")
         return redirect(url_for("pago.pago"))
 
-    success = _abs_url_for("pago.mp_success")
-    failure = _abs_url_for("pago.mp_failure")
-    pending = _abs_url_for("pago.mp_pending")
-    webhook = _abs_url_for("pago.mp_webhook")
+    back = _mp_back_urls()
+    success, failure, pending, webhook = back["success"], back["failure"], back["pending"], back["webhook"]
 
-    if not (_valid_url(success) and _valid_url(failure) and _valid_url(pending)):
+    if not back["valid"]:
         current_app.logger.error(
             "Back URLs inválidas: success=%s failure=%s pending=%s base=%s host_url=%s",
-            success, failure, pending, os.getenv("PUBLIC_BASE_URL"), request.host_url
+            success, failure, pending, current_app.config.get("PUBLIC_BASE_URL"), request.host_url
         )
         flash("No se pudo iniciar el pago: back_urls inválidas (ver logs).", "danger")
         return redirect(url_for("pago.pago"))
@@ -195,7 +289,7 @@ def pago():
             "title": sel.get("titulo", "Entrada de cine"),
             "quantity": 1,
             "currency_id": currency,
-            "unit_price": float(total),
+            "unit_price": total / 100,
         }],
         "payer": {"email": email},
         "back_urls": {"success": success, "failure": failure, "pending": pending},
@@ -208,10 +302,10 @@ def pago():
         "external_reference": str(trx_id),
     }
     # auto_return solo si success es https (recomendado en producción)
-    if success.startswith("https://"):
+    if back["success_https"]:
         pref_data["auto_return"] = "approved"
     # Agregar webhook solo si no estamos en local
-    if not _is_local(webhook):
+    if not back["webhook_local"]:
         pref_data["notification_url"] = webhook
 
     try:
@@ -229,7 +323,7 @@ def pago():
     if status not in (200, 201) or not init_point:
         current_app.logger.error(
             "Error creando preferencia MP | status=%s | resp=%s | back_urls=%s | public_base=%s | host_url=%s | sent_auto_return=%s",
-            status, resp, pref_data.get("back_urls"), os.getenv("PUBLIC_BASE_URL"), request.host_url,
+            status, resp, pref_data.get("back_urls"), current_app.config.get("PUBLIC_BASE_URL"), request.host_url,
             pref_data.get("auto_return")
         )
         msg = resp.get("message")
@@ -244,10 +338,9 @@ def pago():
         return redirect(url_for("pago.pago"))
 
     conn.execute(
-        "UPDATE transacciones SET estado=?, mp_preference_id=? WHERE id=?",
+        _SQL_UPDATE_PREF,
         ("PENDIENTE", str(pref_id), trx_id),
     )
-    conn.commit()
     return redirect(init_point)
 
 @bp.route("/pago/mp/success")
@@ -270,7 +363,9 @@ def mp_success():
         flash("El pago no fue aprobado.", "warning")
         return redirect(url_for("pago.mp_failure"))
 
-    t_ent, t_combo, total, combos, seats, sel = _calcular_totales()
+    # El total sale de la fila (lo que se cobró), no de recalcular la sesión
+    combos = _combos_from_session()
+    sel = _seleccion_from_session()
     hold_token = session.get("hold_token")
     try:
         confirmados = db_mod.confirm_seats(
@@ -292,60 +387,26 @@ def mp_success():
     brand = (resp.get("payment_method", {}) or {}).get("id")
     last4 = (resp.get("card", {}) or {}).get("last_four_digits")
     conn = get_conn()
-    conn.execute(
-        "UPDATE transacciones SET estado=?, brand=?, last4=?, mp_payment_id=?, fecha_actualizacion=? WHERE id=?",
+    row = conn.execute(
+        _SQL_UPDATE_APPROVED,
         ("APROBADO", brand, last4, str(pid), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), trx_id),
-    )
-    conn.commit()
+    ).fetchone()
+    total_cents = (row["monto_cents"] or 0) if row else _calcular_totales()[2]
 
     email = session.get("checkout_email") or session.get("user_autofill", {}).get("email", "")
     sucursal = session.get("branch") or current_app.config.get("DEFAULT_BRANCH", "-")
     auth_code = f"MP-{pid}"
-    qr_path = generar_qr(trx_id=trx_id, verify_url=None, extra={"email": email, "auth": auth_code})
-    pdf_path = generar_comprobante_pdf(
-        trx_id=trx_id, cliente=email or "-", email=email or "-",
-        pelicula=sel.get("titulo", "-"),
-        fecha_funcion=sel.get("fecha", "-"), hora_funcion=sel.get("hora", "-"),
-        sala=sel.get("sala", "-"),
-        asientos=confirmados,
-        combos=[{"nombre": c["nombre"], "cantidad": 1, "precio": c["precio"]} for c in combos],
-        total=float(total), sucursal=sucursal, qr_path=qr_path,
-    )
-
-    # -------- ENVÍOS DE EMAIL --------
-    # 1) Al CLIENTE (con adjunto PDF)
-    try:
-        enviar_ticket(
-            destino=email,
-            asunto=f"Comprobante TRX #{trx_id}",
-            cuerpo=(f"Gracias por su compra.\n\nSucursal: {sucursal}\n"
-                    f"Película: {sel.get('titulo','-')}\n"
-                    f"Fecha/Hora: {sel.get('fecha','-')} {sel.get('hora','-')}\n"
-                    f"Asientos: {', '.join(confirmados) if confirmados else '-'}\n"
-                    f"Monto: ${total:.2f}\nCódigo de autorización: {auth_code}\n"),
-            adjunto_path=pdf_path,
-        )
-    except Exception as e:
-        current_app.logger.warning("Email al cliente no enviado: %s", e)
 
-    # 2) Al CINE (copia interna). Configurá CINEMA_SALES_EMAIL=ventas@tu-cine.com.ar
-    sales_email = (os.getenv("CINEMA_SALES_EMAIL") or "").strip()
-    if sales_email:
-        try:
-            enviar_ticket(
-                destino=sales_email,
-                asunto=f"[Copia interna] TRX #{trx_id} aprobada",
-                cuerpo=(f"Se registró una venta aprobada.\n\nCliente: {email or '-'}\n"
-                        f"Sucursal: {sucursal}\n"
-                        f"Película: {sel.get('titulo','-')}\n"
-                        f"Fecha/Hora: {sel.get('fecha','-')} {sel.get('hora','-')}\n"
-                        f"Asientos: {', '.join(confirmados) if confirmados else '-'}\n"
-                        f"Total: ${total:.2f}\nBrand/Last4: {brand or '-'} • {last4 or '----'}\n"
-                        f"Auth: {auth_code}\nTRX local: {trx_id}\n"),
-                adjunto_path=pdf_path,  # Podés sacar el adjunto si no querés que llegue al cine
-            )
-        except Exception as e:
-            current_app.logger.warning("Email interno (cine) no enviado: %s", e)
+    # QR + PDF + emails fuera del request (pool "comprobantes"): la página de OK
+    # no espera el render ni el SMTP. Mientras el PDF no está en disco, la
+    # descarga responde "generando" (ver archivos.descargar_comprobante).
+    from app.service import background
+    background.submit(
+        "comprobantes", _emitir_comprobante,
+        trx_id=trx_id, email=email, sucursal=sucursal, sel=sel,
+        confirmados=list(confirmados), combos=combos, total_cents=total_cents,
+        auth_code=auth_code, brand=brand, last4=last4,
+    )
 
     comprobante_url = url_for("archivos.descargar_comprobante", trx_id=trx_id)
 
@@ -357,17 +418,68 @@ def mp_success():
     return render_template(
         "pago_ok.html",
         exito="¡Pago aprobado!",
+        comprobante_pendiente=True,
         trx_id=trx_id,
         comprobante_url=comprobante_url,
         seleccion=sel,
         seats=confirmados,
         combos=combos,
-        total=float(total),
+        total=_cents_to_decimal(total_cents),
         brand=brand,
         last4=last4,
         auth_code=auth_code,
     )
 
+def _emitir_comprobante(*, trx_id: int, email: str, sucursal: str, sel: dict,
+                        confirmados: List[str], combos: List[dict], total_cents: int,
+                        auth_code: str, brand: str | None, last4: str | None) -> None:
+    """Genera QR y PDF y manda los emails (cliente + copia al cine) en una sola conexión SMTP."""
+    from app.service.qrs import generar_qr
+    from app.service.pdfs import generar_comprobante_pdf
+    # QR y PDF van en secuencia a propósito: ambos son CPU en Python puro (GIL),
+    # así que paralelizarlos no acorta nada, y esto ya corre fuera del request.
+    qr_path = generar_qr(trx_id=trx_id, verify_url=None, extra={"email": email, "auth": auth_code})
+    pdf_path = generar_comprobante_pdf(
+        trx_id=trx_id, cliente=email or "-", email=email or "-",
+        pelicula=sel.get("titulo", "-"),
+        fecha_funcion=sel.get("fecha", "-"), hora_funcion=sel.get("hora", "-"),
+        sala=sel.get("sala", "-"),
+        asientos=confirmados,
+        combos=[{"nombre": c["nombre"], "cantidad": 1, "precio": c["precio"]} for c in combos],
+        total=_cents_to_decimal(total_cents), sucursal=sucursal, qr_path=qr_path,
+    )
+    total_str = _fmt_cents(total_cents)  # mismo texto en ambos emails
+
+    # -------- ENVÍOS DE EMAIL --------
+    # 1) Al CLIENTE (con adjunto PDF)
+    envios = [dict(
+        destino=email,
+        asunto=f"Comprobante TRX #{trx_id}",
+        cuerpo=(f"Gracias por su compra.\n\nSucursal: {sucursal}\n"
+                f"Película: {sel.get('titulo','-')}\n"
+                f"Fecha/Hora: {sel.get('fecha','-')} {sel.get('hora','-')}\n"
+                f"Asientos: {', '.join(confirmados) if confirmados else '-'}\n"
+                f"Monto: ${total_str}\nCódigo de autorización: {auth_code}\n"),
+        adjunto_path=pdf_path,
+    )]
+
+    # 2) Al CINE (copia interna). Configurá CINEMA_SALES_EMAIL=ventas@tu-cine.com.ar
+    sales_email = (os.getenv("CINEMA_SALES_EMAIL") or "").strip()
+    if sales_email:
+        envios.append(dict(
+            destino=sales_email,
+            asunto=f"[Copia interna] TRX #{trx_id} aprobada",
+            cuerpo=(f"Se registró una venta aprobada.\n\nCliente: {email or '-'}\n"
+                    f"Sucursal: {sucursal}\n"
+                    f"Película: {sel.get('titulo','-')}\n"
+                    f"Fecha/Hora: {sel.get('fecha','-')} {sel.get('hora','-')}\n"
+                    f"Asientos: {', '.join(confirmados) if confirmados else '-'}\n"
+                    f"Total: ${total_str}\nBrand/Last4: {brand or '-'} • {last4 or '----'}\n"
+                    f"Auth: {auth_code}\nTRX local: {trx_id}\n"),
+            adjunto_path=pdf_path,  # Podés sacar el adjunto si no querés que llegue al cine
+        ))
+    enviar_tickets(envios)
+
 @bp.route("/pago/mp/failure")
 def mp_failure():
     flash("El pago fue cancelado o rechazado.", "warning")
@@ -380,17 +492,73 @@ def mp_pending():
 
 @bp.route("/pago/mp/webhook", methods=["POST"])
 def mp_webhook():
-    try:
-        data = request.get_json(force=True, silent=True) or {}
-        current_app.logger.info("MP webhook: %s", data)
-    except Exception as e:
-        current_app.logger.warning("Webhook MP sin JSON: %s", e)
+    """
+    Notificación de MP. Sólo se toma el id del pago: el estado real se
+    consulta a la API en el pool "mp" (ver _sincronizar_pago_mp), así MP recibe
+    el 200 enseguida y un body falsificado no puede cambiar nada.
+    get_data(cache=False) evita guardar una copia del body en el request.
+    """
+    logger = current_app.logger
+    raw = request.get_data(cache=False)
+    body: Dict[str, Any] = {}
+    if raw:
+        try:
+            body = _json_loads(raw)
+        except ValueError as e:
+            logger.warning("Webhook MP sin JSON: %s", e)
+    if not isinstance(body, dict):
+        body = {}
+    # Logging perezoso: el dict sólo se formatea si INFO está habilitado
+    logger.info("MP webhook: %s", body)
+
+    args = request.args
+    topic = body.get("type") or body.get("topic") or args.get("type") or args.get("topic")
+    payment_id = (body.get("data") or {}).get("id") or args.get("data.id") or args.get("id")
+    if topic == "payment" and payment_id:
+        from app.service import background
+        background.submit("mp", _sincronizar_pago_mp, str(payment_id))
     return ("", 200)
 
-def _marcar(trx_id: int, estado: str) -> None:
+# status de MP -> estado local (los mismos que usan mp_success/_marcar)
+_MP_ESTADOS = {
+    "approved": "APROBADO",
+    "rejected": "RECHAZADA", "cancelled": "RECHAZADA", "refunded": "RECHAZADA",
+    "charged_back": "RECHAZADA",
+    "pending": "PENDIENTE", "in_process": "PENDIENTE", "authorized": "PENDIENTE",
+}
+
+# Un solo UPDATE condicional: un webhook repetido no toca nada y una fila ya
+# APROBADA (por mp_success o un webhook anterior) no vuelve atrás.
+_SQL_SYNC_MP = (
+    "UPDATE transacciones SET estado=?, mp_payment_id=?, fecha_actualizacion=? "
+    "WHERE id=? AND COALESCE(estado, '') NOT IN (?, 'APROBADO') RETURNING id"
+)
+
+def _sincronizar_pago_mp(payment_id: str) -> bool:
+    """
+    Consulta el pago en MP y actualiza el estado de la transacción local
+    (external_reference = id de la transacción). Corre en segundo plano.
+    Asientos y comprobante siguen en mp_success, que tiene el hold token de
+    la sesión. True si se actualizó la fila.
+    """
+    resp = _sdk_mp().payment().get(payment_id).get("response", {}) or {}
+    estado = _MP_ESTADOS.get(resp.get("status"))
+    try:
+        trx_id = int(resp.get("external_reference") or "")
+    except ValueError:
+        trx_id = None
+    if not estado or trx_id is None:
+        current_app.logger.info("Pago MP %s sin transacción local o estado no mapeado", payment_id)
+        return False
+    row = get_conn().execute(
+        _SQL_SYNC_MP,
+        (estado, str(payment_id), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), trx_id, estado),
+    ).fetchone()
+    return row is not None
+
+def _marcar(trx_id: int, estado: str, now_iso: str | None = None) -> None:
     conn = get_conn()
     conn.execute(
-        "UPDATE transacciones SET estado=?, fecha_actualizacion=? WHERE id=?",
-        (estado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), trx_id),
+        _SQL_MARCAR,
+        (estado, now_iso or datetime.now().strftime("%Y-%m-%d %H:%M:%S"), trx_id),
     )
-    conn.commit()
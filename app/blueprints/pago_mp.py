@@ -7,17 +7,31 @@ Mantiene compatibilidad con el sistema de tarjetas existente y agrega MercadoPag
 
 from __future__ import annotations
 
-import json
 import logging
+import time
 import uuid
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
 from typing import List, Dict, Any, Optional
 
+try:  # orjson es opcional: serializador en C, bastante más rápido que json
+    from orjson import dumps as _orjson_dumps
+
+    def _json_dumps(obj) -> str:
+        # La columna es TEXT: orjson devuelve bytes (UTF-8)
+        return _orjson_dumps(obj).decode()
+except ImportError:  # pragma: no cover
+    import json
+
+    def _json_dumps(obj) -> str:
+        # Mismo formato compacto que orjson
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
 from flask import (
     Blueprint,
     current_app,
     flash,
+    g,
     render_template,
     request,
     session,
@@ -31,7 +45,7 @@ from app.service.payments import validar_tarjeta, detectar_brand
 from app.service.qrs import generar_qr
 from app.service.pdfs import generar_comprobante_pdf
 from app.service.emailer import enviar_ticket
-from app.db import get_conn, execute, query_one
+from app.db import execute, query_one
 from app.data.seed import COMBOS_CATALOG
 
 # Nuevo import para MercadoPago
@@ -42,11 +56,17 @@ logger = logging.getLogger(__name__)
 
 # ===================== Helpers ===================== #
 
+# Catálogo indexado por id, una vez al importar (el catálogo es estático)
+_COMBOS_BY_ID = {c["id"]: c for c in COMBOS_CATALOG}
+
 def _combos_from_session() -> List[dict]:
     """Obtiene los combos seleccionados desde sesión."""
-    ids = [int(x) for x in session.get("combos", [])]
-    idset = set(ids)
-    return [c for c in COMBOS_CATALOG if c["id"] in idset]
+    raw = session.get("combos")
+    if not raw:  # lo más común: combos es opcional
+        return []
+    # dict.fromkeys: sin duplicados y en el orden elegido; O(k), sin recorrer el catálogo
+    ids = dict.fromkeys(map(int, raw))
+    return [_COMBOS_BY_ID[i] for i in ids if i in _COMBOS_BY_ID]
 
 def _seleccion_from_session() -> dict:
     """Obtiene la selección de película/función desde sesión."""
@@ -56,97 +76,152 @@ def _seats_from_session() -> List[str]:
     """Obtiene los asientos seleccionados desde sesión."""
     return session.get("seats", []) or []
 
+# Precios de combos en centavos, calculados una vez (el catálogo es estático)
+_COMBO_CENTS = {c["id"]: int(round(c.get("precio", 0) * 100)) for c in COMBOS_CATALOG}
+
+# Claves del carrito / checkout que se limpian al aprobarse el pago
+_SESSION_CARRITO = ("seats", "combos", "movie_selection")
+_SESSION_CHECKOUT = _SESSION_CARRITO + ("pending_transaction_id", "mp_preference_id")
+
+def _limpiar_sesion(keys: tuple) -> None:
+    """
+    Saca de la sesión sólo las claves presentes. Cada pop marca la sesión como
+    modificada aunque la clave no exista; si no hay nada que sacar (p. ej. al
+    recargar /exito) no se vuelve a firmar ni reenviar la cookie.
+    """
+    presentes = [k for k in keys if k in session]
+    for k in presentes:
+        session.pop(k)
+
 def _precio_entrada() -> Decimal:
-    """Precio unitario de la entrada desde config."""
-    raw = str(current_app.config.get("TICKET_PRICE", "2500"))
-    try:
-        return Decimal(raw)
-    except Exception:
-        return Decimal("2500")
+    """Precio unitario de la entrada desde config (se parsea una vez por request)."""
+    precio = g.get("_ticket_price")
+    if precio is None:
+        raw = str(current_app.config.get("TICKET_PRICE", "2500"))
+        try:
+            precio = Decimal(raw)
+        except Exception:
+            precio = Decimal("2500")
+        g._ticket_price = precio
+    return precio
+
+def _precio_entrada_cents() -> int:
+    return int((_precio_entrada() * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+def _cents_to_decimal(cents: int) -> Decimal:
+    # Decimal exacto con 2 decimales (p.ej. 12500 -> Decimal("125.00"))
+    return Decimal(cents).scaleb(-2)
 
 def _calcular_totales_server_side() -> tuple[Decimal, Decimal, Decimal, list[dict], list[str], dict]:
     """
     Calcula totales en el servidor.
     Returns: (total_entradas, total_combos, total, combos_sel, seats, seleccion)
+    Memo en g: el GET/POST y los helpers de pago piden lo mismo varias veces.
+    Las cuentas se hacen en centavos enteros; Decimal sólo en el resultado.
     """
-    TWO = Decimal("0.01")
-    precio_ent = _precio_entrada()
+    cached = g.get("_totales_cache")
+    if cached is not None:
+        return cached
     seats = _seats_from_session()
     combos_sel = _combos_from_session()
     seleccion = _seleccion_from_session()
 
-    total_entradas = (precio_ent * Decimal(len(seats))).quantize(TWO, rounding=ROUND_HALF_UP)
-    total_combos = sum(Decimal(str(c.get("precio", 0))) for c in combos_sel)
-    total_combos = Decimal(total_combos).quantize(TWO, rounding=ROUND_HALF_UP)
-    total = (total_entradas + total_combos).quantize(TWO, rounding=ROUND_HALF_UP)
+    total_entradas_c = _precio_entrada_cents() * len(seats)
+    total_combos_c = sum(_COMBO_CENTS[c["id"]] for c in combos_sel)
+    total_c = total_entradas_c + total_combos_c
 
-    return total_entradas, total_combos, total, combos_sel, seats, seleccion
+    g._totales_cache = res = (
+        _cents_to_decimal(total_entradas_c), _cents_to_decimal(total_combos_c),
+        _cents_to_decimal(total_c), combos_sel, seats, seleccion,
+    )
+    return res
+
+def _asientos_combos_json(seleccion: dict, seats: List[str], combos: List[dict]) -> tuple[str, str]:
+    """
+    Serializa asientos y combos de la transacción (columnas asientos_json y
+    combos_json). Una sola fila en transacciones lleva todo el carrito: un único
+    INSERT, sin una escritura por asiento/combo.
+    """
+    # Lo que comparten todos los asientos se arma una vez; cada fila sólo
+    # agrega su número (el orden de claves del JSON se mantiene)
+    comun = {
+        "precio": float(_precio_entrada()),
+        "funcion_id": seleccion.get("funcion_id"),
+        "pelicula": seleccion.get("pelicula", ""),
+        "fecha": seleccion.get("fecha", ""),
+        "hora": seleccion.get("hora", ""),
+        "sala": seleccion.get("sala", ""),
+    }
+    asientos_data = [{"numero": seat, **comun} for seat in seats]
+    # Por ahora asumimos cantidad 1
+    combos_data = [
+        {"id": c["id"], "nombre": c["nombre"], "precio": c["precio"], "cantidad": 1}
+        for c in combos
+    ]
+    return _json_dumps(asientos_data), _json_dumps(combos_data)
+
+# -------- SQL --------
+# Texto fijo por sentencia: get_conn() abre la conexión con cached_statements,
+# así cada una se prepara una vez por conexión y después sólo se re-bindea.
+_SQL_INSERT_PENDIENTE = """
+    INSERT INTO transacciones (
+        email_cliente, total_pesos, estado, funcion_id, pelicula,
+        fecha_funcion, hora_funcion, sala, asientos_json, combos_json,
+        external_reference, ip_cliente, user_agent, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_INSERT_TARJETA = """
+    INSERT INTO transacciones (
+        email_cliente, total_pesos, estado, funcion_id, pelicula,
+        fecha_funcion, hora_funcion, sala, asientos_json, combos_json,
+        external_reference, brand, last4, exp_mes, exp_anio, auth_code,
+        ip_cliente, user_agent, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPDATE_PREFERENCIA = "UPDATE transacciones SET mp_preference_id = ? WHERE id = ?"
+_SQL_SELECT_TRX = "SELECT * FROM transacciones WHERE id = ?"
+_SQL_SELECT_ESTADO = (
+    "SELECT id, estado, mp_payment_id, external_reference FROM transacciones WHERE id = ?"
+)
 
 def crear_transaccion_pendiente(email: str, total: Decimal, seleccion: dict, 
-                              seats: List[str], combos: List[dict]) -> int:
+                              seats: List[str], combos: List[dict]) -> tuple[int, str]:
     """
     Crea una transacción en estado PENDIENTE en la base de datos.
     
     Returns:
-        int: ID de la transacción creada
+        (int, str): ID de la transacción creada y su external_reference
     """
     # Generar external_reference único
-    external_reference = f"TXN_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
-    
-    # Preparar datos de asientos y combos
-    asientos_data = []
-    for seat in seats:
-        asientos_data.append({
-            "numero": seat,
-            "precio": float(_precio_entrada()),
-            "funcion_id": seleccion.get("funcion_id"),
-            "pelicula": seleccion.get("pelicula", ""),
-            "fecha": seleccion.get("fecha", ""),
-            "hora": seleccion.get("hora", ""),
-            "sala": seleccion.get("sala", "")
-        })
+    external_reference = f"TXN_{time.time_ns() // 1_000_000_000}_{uuid.uuid4().hex[:8]}"
     
-    combos_data = []
-    for combo in combos:
-        combos_data.append({
-            "id": combo["id"],
-            "nombre": combo["nombre"],
-            "precio": combo["precio"],
-            "cantidad": 1  # Por ahora asumimos cantidad 1
-        })
+    asientos_json, combos_json = _asientos_combos_json(seleccion, seats, combos)
     
-    # Insertar en base de datos
-    conn = get_conn()
-    with conn:
-        trans_id = execute(
-            """
-            INSERT INTO transacciones (
-                email_cliente, total_pesos, estado, funcion_id, pelicula,
-                fecha_funcion, hora_funcion, sala, asientos_json, combos_json,
-                external_reference, ip_cliente, user_agent, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            [
-                email,
-                float(total),
-                "PENDIENTE",
-                seleccion.get("funcion_id"),
-                seleccion.get("pelicula", ""),
-                seleccion.get("fecha", ""),
-                seleccion.get("hora", ""),
-                seleccion.get("sala", ""),
-                json.dumps(asientos_data),
-                json.dumps(combos_data),
-                external_reference,
-                request.environ.get('REMOTE_ADDR'),
-                request.environ.get('HTTP_USER_AGENT'),
-                datetime.now()
-            ],
-            commit=True
-        )
+    # Insertar en base de datos: una sola sentencia (autocommit), el carrito
+    # completo viaja en las columnas JSON
+    trans_id = execute(
+        _SQL_INSERT_PENDIENTE,
+        [
+            email,
+            float(total),
+            "PENDIENTE",
+            seleccion.get("funcion_id"),
+            seleccion.get("pelicula", ""),
+            seleccion.get("fecha", ""),
+            seleccion.get("hora", ""),
+            seleccion.get("sala", ""),
+            asientos_json,
+            combos_json,
+            external_reference,
+            request.environ.get('REMOTE_ADDR'),
+            request.environ.get('HTTP_USER_AGENT'),
+            datetime.now()
+        ],
+        commit=True
+    )
     
     logger.info(f"Transacción PENDIENTE creada: {trans_id} - {external_reference}")
-    return trans_id
+    return trans_id, external_reference
 
 # ===================== Rutas ===================== #
 
@@ -209,27 +284,19 @@ def procesar_pago_mercadopago():
             return redirect(url_for('main.inicio'))
 
         # Crear transacción pendiente
-        trans_id = crear_transaccion_pendiente(email, total, seleccion, seats, combos_sel)
+        trans_id, external_reference = crear_transaccion_pendiente(email, total, seleccion, seats, combos_sel)
         
         # Crear items para MercadoPago
+        # Una línea por función (quantity = cantidad de asientos), no un dict por asiento
         items = mp_service.crear_items_desde_carrito(
-            entradas=[{
-                "funcion_id": seleccion.get("funcion_id"),
-                "asiento": seat,
-                "precio": float(_precio_entrada()),
-                "pelicula": seleccion.get("pelicula", ""),
-                "fecha": seleccion.get("fecha", ""),
-                "hora": seleccion.get("hora", "")
-            } for seat in seats],
-            combos=combos_sel
+            entradas=[],
+            combos=combos_sel,
+            funcion=seleccion,
+            asientos=seats,
+            precio_entrada=float(_precio_entrada()),
         )
 
         # Crear preferencia en MercadoPago
-        external_reference = query_one(
-            "SELECT external_reference FROM transacciones WHERE id = ?", 
-            [trans_id]
-        )["external_reference"]
-
         resultado_mp = mp_service.crear_preferencia_pago(
             items=items,
             payer_email=email,
@@ -245,14 +312,10 @@ def procesar_pago_mercadopago():
             flash("Error al procesar el pago. Intenta nuevamente.", "error")
             return redirect(url_for('pago_mp.procesar_pago'))
 
-        # Actualizar transacción con datos de MP
+        # Actualizar transacción con datos de MP (external_reference ya quedó en el INSERT)
         execute(
-            """
-            UPDATE transacciones 
-            SET mp_preference_id = ?, external_reference = ? 
-            WHERE id = ?
-            """,
-            [resultado_mp["preference_id"], external_reference, trans_id],
+            _SQL_UPDATE_PREFERENCIA,
+            [resultado_mp["preference_id"], trans_id],
             commit=True
         )
 
@@ -304,7 +367,7 @@ def procesar_pago_tarjeta():
     # Simular procesamiento de tarjeta (aquí integrarías con tu gateway real)
     brand = detectar_brand(pan)
     last4 = pan[-4:] if len(pan) >= 4 else pan
-    auth_code = f"AUTH_{int(datetime.now().timestamp())}"
+    auth_code = f"AUTH_{time.time_ns() // 1_000_000_000}"
 
     # Crear transacción aprobada directamente
     trans_id = crear_transaccion_con_tarjeta(
@@ -314,14 +377,11 @@ def procesar_pago_tarjeta():
 
     # Confirmar asientos y generar comprobante
     from app.blueprints.mercadopago import confirmar_pago_aprobado
-    confirmar_pago_aprobado(trans_id, seleccion.get("funcion_id"), 
-                          json.dumps([{"numero": seat} for seat in seats]),
-                          json.dumps(combos_sel), email)
+    confirmar_pago_aprobado(trans_id, seleccion.get("funcion_id"),
+                          [{"numero": seat} for seat in seats], email)
 
     # Limpiar sesión
-    session.pop("seats", None)
-    session.pop("combos", None)
-    session.pop("movie_selection", None)
+    _limpiar_sesion(_SESSION_CARRITO)
 
     flash("¡Pago procesado exitosamente!", "success")
     return redirect(url_for('pago_mp.pago_ok', trans_id=trans_id))
@@ -330,52 +390,24 @@ def crear_transaccion_con_tarjeta(email: str, total: Decimal, seleccion: dict,
                                 seats: List[str], combos: List[dict], brand: str,
                                 last4: str, exp_mes: int, exp_anio: int, auth_code: str) -> int:
     """Crea una transacción aprobada con tarjeta"""
-    external_reference = f"TXN_CARD_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
-    
-    asientos_data = []
-    for seat in seats:
-        asientos_data.append({
-            "numero": seat,
-            "precio": float(_precio_entrada()),
-            "funcion_id": seleccion.get("funcion_id"),
-            "pelicula": seleccion.get("pelicula", ""),
-            "fecha": seleccion.get("fecha", ""),
-            "hora": seleccion.get("hora", ""),
-            "sala": seleccion.get("sala", "")
-        })
+    external_reference = f"TXN_CARD_{time.time_ns() // 1_000_000_000}_{uuid.uuid4().hex[:8]}"
     
-    combos_data = []
-    for combo in combos:
-        combos_data.append({
-            "id": combo["id"],
-            "nombre": combo["nombre"],
-            "precio": combo["precio"],
-            "cantidad": 1
-        })
+    asientos_json, combos_json = _asientos_combos_json(seleccion, seats, combos)
     
-    conn = get_conn()
-    with conn:
-        trans_id = execute(
-            """
-            INSERT INTO transacciones (
-                email_cliente, total_pesos, estado, funcion_id, pelicula,
-                fecha_funcion, hora_funcion, sala, asientos_json, combos_json,
-                external_reference, brand, last4, exp_mes, exp_anio, auth_code,
-                ip_cliente, user_agent, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            [
-                email, float(total), "APROBADO", seleccion.get("funcion_id"),
-                seleccion.get("pelicula", ""), seleccion.get("fecha", ""),
-                seleccion.get("hora", ""), seleccion.get("sala", ""),
-                json.dumps(asientos_data), json.dumps(combos_data),
-                external_reference, brand, last4, exp_mes, exp_anio, auth_code,
-                request.environ.get('REMOTE_ADDR'),
-                request.environ.get('HTTP_USER_AGENT'),
-                datetime.now()
-            ],
-            commit=True
-        )
+    trans_id = execute(
+        _SQL_INSERT_TARJETA,
+        [
+            email, float(total), "APROBADO", seleccion.get("funcion_id"),
+            seleccion.get("pelicula", ""), seleccion.get("fecha", ""),
+            seleccion.get("hora", ""), seleccion.get("sala", ""),
+            asientos_json, combos_json,
+            external_reference, brand, last4, exp_mes, exp_anio, auth_code,
+            request.environ.get('REMOTE_ADDR'),
+            request.environ.get('HTTP_USER_AGENT'),
+            datetime.now()
+        ],
+        commit=True
+    )
     
     return trans_id
 
@@ -392,7 +424,7 @@ def pago_ok(trans_id=None):
     
     # Obtener información de la transacción
     transaccion = query_one(
-        "SELECT * FROM transacciones WHERE id = ?", 
+        _SQL_SELECT_TRX,
         [trans_id]
     )
     
@@ -402,13 +434,9 @@ def pago_ok(trans_id=None):
     
     # Limpiar sesión si el pago está aprobado
     if transaccion["estado"] == "APROBADO":
-        session.pop("seats", None)
-        session.pop("combos", None)
-        session.pop("movie_selection", None)
-        session.pop("pending_transaction_id", None)
-        session.pop("mp_preference_id", None)
+        _limpiar_sesion(_SESSION_CHECKOUT)
     
-    return render_template("pago_ok_mp.html", transaccion=dict(transaccion))
+    return render_template("pago_ok_mp.html", transaccion=transaccion)
 
 @bp.route("/error")
 def pago_error():
@@ -426,7 +454,7 @@ def pago_pendiente():
 def verificar_estado(trans_id: int):
     """API para verificar el estado de una transacción"""
     transaccion = query_one(
-        "SELECT id, estado, mp_payment_id, external_reference FROM transacciones WHERE id = ?",
+        _SQL_SELECT_ESTADO,
         [trans_id]
     )
     
@@ -26,14 +26,15 @@ Requisitos:
 from __future__ import annotations
 
 import os
+import time
 import uuid
-import importlib
-from typing import Iterable
+from typing import Iterable, Optional
 
 from flask import (
     Blueprint,
     current_app,
     flash,
+    g,
     redirect,
     render_template,
     request,
@@ -44,6 +45,11 @@ from flask import (
 from app.data.seed import MOVIES, COMBOS_CATALOG
 import app.db as db_mod
 
+# Se verifica una sola vez al importar: si app.db quedó incompleto, el deploy
+# falla al arrancar en vez de recargar el módulo dentro de cada reserva.
+if not all(hasattr(db_mod, n) for n in ("get_occupied_seats", "hold_seats", "get_catalog_stamp")):
+    raise ImportError("app.db no expone get_occupied_seats/hold_seats/get_catalog_stamp")
+
 bp = Blueprint("venta", __name__)
 
 
@@ -69,17 +75,48 @@ def _rows_cols_from_config() -> tuple[list[str], int, int]:
     return rows_str, cols, max_per
 
 
+# Catálogo cacheado entre requests: (stamp, películas). El stamp sale de la BD
+# (db.get_catalog_stamp: contador que suben los triggers de funciones + fecha
+# del día), así un cambio hecho por el admin en cualquier worker invalida la
+# copia de todos los demás en el request siguiente.
+_movies_cache: Optional[tuple[tuple[int, str], list[dict]]] = None
+
+
 def _movies_source() -> list[dict]:
+    """
+    Catálogo de películas con sus funciones (sólo lectura: se comparte entre
+    requests). Memo en g dentro del request y cache de proceso mientras no
+    cambie el stamp del catálogo.
+    """
+    global _movies_cache
+    movies = g.get("_movies")
+    if movies is not None:
+        return movies
+    stamp = db_mod.get_catalog_stamp()
+    entry = _movies_cache
+    if stamp is not None and entry is not None and entry[0] == stamp:
+        movies = entry[1]
+    else:
+        movies, ok = _load_movies()
+        # Un error de DB (o sin stamp) no se cachea: el próximo request reintenta
+        if ok and stamp is not None:
+            _movies_cache = (stamp, movies)
+    g._movies = movies
+    return movies
+
+
+def _load_movies() -> tuple[list[dict], bool]:
     """
     Fuente de catálogo:
     - Lee las funciones desde la base de datos (creadas por admin)
     - Fallback a datos del archivo seed.py si no hay funciones en DB
+    Devuelve (películas, se pudo leer la DB).
     """
     try:
         # Intentar cargar funciones desde la base de datos
         funciones_db = db_mod.query_all("""
             SELECT DISTINCT 
-                pelicula_id as id, titulo, genero, duracion, clasificacion,
+                id as funcion_id, pelicula_id as id, titulo, genero, duracion, clasificacion,
                 poster, descripcion, trailer_url, fecha, hora, sala
             FROM funciones
             WHERE fecha >= date('now')
@@ -105,6 +142,7 @@ def _movies_source() -> list[dict]:
                     }
                 
                 movies_dict[movie_id]["funciones"].append({
+                    "id": f['funcion_id'],
                     "fecha": f['fecha'],
                     "hora": f['hora'],
                     "sala": f['sala']
@@ -112,17 +150,17 @@ def _movies_source() -> list[dict]:
             
             movies = list(movies_dict.values())
             current_app.logger.info(f"📽️ Cargadas {len(movies)} películas desde base de datos")
-            return movies
+            return movies, True
         
         else:
             # Fallback a datos hardcodeados si no hay funciones en DB
             current_app.logger.info("📽️ No hay funciones en DB, usando datos del archivo seed.py")
-            return MOVIES or []
+            return MOVIES or [], True
         
     except Exception as e:
         current_app.logger.error(f"Error al cargar películas desde DB: {e}")
         current_app.logger.info("📽️ Fallback: usando datos del archivo seed.py")
-        return MOVIES or []
+        return MOVIES or [], False
 
 
 def _normalize_seats(value: str | Iterable[str]) -> list[str]:
@@ -168,16 +206,6 @@ def _ensure_hold_token() -> str:
     return tok
 
 
-def _ensure_db_symbols() -> None:
-    """
-    Defensa ante recargas calientes: si por alguna razón el módulo quedó
-    parcialmente inicializado, recárgalo para garantizar símbolos.
-    """
-    global db_mod  # noqa: PLW0603
-    if not hasattr(db_mod, "get_occupied_seats") or not hasattr(db_mod, "hold_seats"):
-        db_mod = importlib.reload(db_mod)
-
-
 # =========================
 # Rutas
 # =========================
@@ -197,14 +225,42 @@ def cartelera():
 def seleccionar_funcion():
     """
     Guarda en sesión la función seleccionada y redirige a /reserva-asientos.
-    Acepta dos variantes:
-    - (movie_id, funcion_idx)
+    Acepta tres variantes:
+    - (movie_id, funcion_id): funciones de la DB; se vuelve a leer la fila
+    - (movie_id, funcion_idx): catálogo de seed.py (sin ids)
     - (movie_id, titulo, sala, fecha, hora)
     """
-    # Variante por índice (usada por tarjetas con múltiples funciones)
     movie_id = (request.form.get("movie_id") or "").strip()
+    funcion_id = request.form.get("funcion_id")
     funcion_idx = request.form.get("funcion_idx")
 
+    if funcion_id is not None:
+        # Id estable contra la DB (no contra el catálogo cacheado del worker):
+        # una función borrada o de otra película no se puede elegir.
+        try:
+            row = db_mod.query_one(
+                "SELECT pelicula_id, titulo, fecha, hora, sala FROM funciones "
+                "WHERE id = ? AND fecha >= date('now')",
+                [int(funcion_id)],
+            )
+        except (TypeError, ValueError):
+            row = None
+        if row is None or str(row["pelicula_id"]) != movie_id:
+            flash("Función inválida", "danger")
+            return redirect(url_for("venta.cartelera"))
+
+        session["movie_selection"] = {
+            "id": movie_id,
+            "titulo": row["titulo"] or "",
+            "sala": row["sala"] or "",
+            "fecha": row["fecha"] or "",
+            "hora": row["hora"] or "",
+        }
+        session.modified = True
+        session.pop("seats", None)  # limpiar asientos previos
+        return redirect(url_for("venta.reserva_asientos"))
+
+    # Variante por índice (catálogo de seed.py, que no tiene ids)
     if funcion_idx is not None:
         try:
             idx = int(funcion_idx)
@@ -252,8 +308,6 @@ def reserva_asientos():
     GET: Renderiza mapa de asientos con ocupados/seleccionados.
     POST: Valida y retiene (hold) los asientos elegidos; redirige a /combos.
     """
-    _ensure_db_symbols()
-
     sel = session.get("movie_selection")
     if not sel:
         flash("Primero elegí una función.", "warning")
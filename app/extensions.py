@@ -4,3 +4,28 @@ from __future__ import annotations
 from flask_mail import Mail
 
 mail = Mail()
+
+# Rate limiting (Flask-Limiter es opcional: sin él los límites no se aplican)
+try:
+    from flask_limiter import Limiter
+    from flask_limiter.util import get_remote_address
+except ImportError:  # pragma: no cover
+    Limiter = None
+
+    def get_remote_address() -> str:
+        from flask import request
+        return request.remote_addr or "127.0.0.1"
+
+# get_remote_address lee request.remote_addr: detrás de nginx depende de que
+# create_app() monte ProxyFix (PROXY_FIX_X_FOR), si no todo llega como 127.0.0.1.
+limiter = Limiter(key_func=get_remote_address) if Limiter else None
+
+
+def rate_limit(limit_value: str, key_func=None, **kwargs):
+    """
+    Decorador de límite por ruta; no-op si Flask-Limiter no está instalado.
+    Uso: @rate_limit("5/minute", key_func=lambda: ..., methods=["POST"])
+    """
+    if limiter is None:
+        return lambda f: f
+    return limiter.limit(limit_value, key_func=key_func, **kwargs)
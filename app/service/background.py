@@ -0,0 +1,54 @@
+# app/service/background.py
+# -*- coding: utf-8 -*-
+"""
+Tareas en segundo plano dentro del proceso (sin broker):
+- Pools de hilos con nombre, separados por tipo de trabajo para que el CPU
+  (PDF/QR) no le quite lugar al I/O (SMTP).
+- Cada tarea corre con su propio app context; lo que dependa del request
+  (url_for(..., _external=True), session) hay que resolverlo antes.
+- Si el proceso se reinicia, las tareas pendientes se pierden.
+- El registro de tareas es local al worker: quien necesite saber si una tarea
+  terminó lo mira en estado compartido (disco/BD), no acá.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from flask import current_app
+
+# Hilos por pool. "email": SMTP (I/O). "comprobantes": QR + PDF (CPU).
+# "mp": consultas a la API de MercadoPago (I/O).
+POOL_SIZES: Dict[str, int] = {"email": 2, "comprobantes": 1, "mp": 2}
+
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(name: str) -> ThreadPoolExecutor:
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = ThreadPoolExecutor(
+                    max_workers=POOL_SIZES.get(name, 1), thread_name_prefix=name
+                )
+    return pool
+
+
+def _run_in_context(app, name: str, fn: Callable[..., Any], args, kwargs) -> Any:
+    with app.app_context():
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            app.logger.error("Error en tarea de segundo plano (%s/%s): %s", name, fn.__name__, e)
+            raise
+
+
+def submit(pool: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """Encola fn(*args, **kwargs) en el pool `pool` y devuelve el Future."""
+    app = current_app._get_current_object()
+    return _get_pool(pool).submit(_run_in_context, app, pool, fn, args, kwargs)
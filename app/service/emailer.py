@@ -4,59 +4,50 @@
 Servicio de email:
 - Usa Flask-Mail para enviar sin exponer AUTH en consola.
 - Si EMAIL_DEBUG=1, NO envía; sólo registra un mensaje informativo.
+- enviar_ticket_async() encola el envío en el pool "email" de
+  app/service/background.py para que la respuesta HTTP no espere el SMTP.
+- enviar_tickets() manda varios emails reutilizando una conexión SMTP.
 """
 
 from __future__ import annotations
 
 import os
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterable, Mapping, Optional
 
 from flask import current_app
 from flask_mail import Message
 
 from app.extensions import mail
+from app.service import background
 
 
-def enviar_ticket(
-    *,
+def _build_message(
     destino: str,
     asunto: str,
     cuerpo: str,
     adjunto_path: Optional[str] = None,
-) -> None:
-    """
-    Envía un email (o lo simula si EMAIL_DEBUG=1).
-
-    :param destino: email destino
-    :param asunto: asunto del correo
-    :param cuerpo: cuerpo en texto plano
-    :param adjunto_path: ruta a PDF (opcional)
-    """
-    cfg = current_app.config
-    if cfg.get("EMAIL_DEBUG", True):
-        # NO enviamos nada en modo debug: sólo logueamos una línea clara.
-        current_app.logger.info(
-            "EMAIL_DEBUG=1: no se envía correo. destino=%s adjunto=%s",
-            destino,
-            adjunto_path or "-",
-        )
-        return
-
-    # Compose message
+    *,
+    _adjuntos: Optional[Dict[str, bytes]] = None,
+) -> Message:
     msg = Message(
         subject=asunto,
         recipients=[destino],
         body=cuerpo,
     )
 
-    # Adjuntar PDF si existe
+    # Adjuntar PDF si existe (dentro de un lote, cada archivo se lee una vez)
     if adjunto_path:
         try:
             p = Path(adjunto_path)
-            if p.exists() and p.is_file():
+            data = _adjuntos.get(adjunto_path) if _adjuntos is not None else None
+            if data is None and p.exists() and p.is_file():
                 with p.open("rb") as f:
                     data = f.read()
+                if _adjuntos is not None:
+                    _adjuntos[adjunto_path] = data
+            if data is not None:
                 msg.attach(
                     filename=p.name,
                     content_type="application/pdf",
@@ -66,12 +57,77 @@ def enviar_ticket(
                 current_app.logger.warning("Adjunto no encontrado: %s", adjunto_path)
         except Exception as e:
             current_app.logger.warning("No se pudo adjuntar %s: %s", adjunto_path, e)
+    return msg
+
 
-    # Enviar con Flask-Mail
+def enviar_ticket(
+    *,
+    destino: str,
+    asunto: str,
+    cuerpo: str,
+    adjunto_path: Optional[str] = None,
+) -> None:
+    """
+    Envía un email (o lo simula si EMAIL_DEBUG=1).
+
+    :param destino: email destino
+    :param asunto: asunto del correo
+    :param cuerpo: cuerpo en texto plano
+    :param adjunto_path: ruta a PDF (opcional)
+    """
+    enviar_tickets([dict(destino=destino, asunto=asunto, cuerpo=cuerpo, adjunto_path=adjunto_path)])
+
+
+def enviar_tickets(envios: Iterable[Mapping[str, Any]]) -> None:
+    """
+    Envía varios emails (mismos campos que enviar_ticket) por una sola
+    conexión SMTP: un único handshake TCP+TLS+AUTH para todo el lote.
+    Un envío que falla se loguea y no corta a los siguientes.
+    """
+    envios = list(envios)
+    if not envios:
+        return
+    cfg = current_app.config
+    if cfg.get("EMAIL_DEBUG", True):
+        # NO enviamos nada en modo debug: sólo logueamos una línea clara.
+        for e in envios:
+            current_app.logger.info(
+                "EMAIL_DEBUG=1: no se envía correo. destino=%s adjunto=%s",
+                e["destino"],
+                e.get("adjunto_path") or "-",
+            )
+        return
+
+    # Enviar con Flask-Mail: una conexión para todo el lote; el mismo PDF
+    # (cliente + copia al cine) se lee de disco una sola vez.
+    adjuntos: Dict[str, bytes] = {}
     try:
-        mail.send(msg)
-        current_app.logger.info("Email enviado a %s (asunto=%s)", destino, asunto)
-    except Exception as e:
-        # No exponemos credenciales ni el intercambio SMTP
-        current_app.logger.error("Error enviando email a %s: %s", destino, e)
-        # No relanzamos; dejamos que el flujo de compra continúe.
+        with mail.connect() as conn:
+            for e in envios:
+                try:
+                    conn.send(_build_message(**e, _adjuntos=adjuntos))
+                    current_app.logger.info("Email enviado a %s (asunto=%s)", e["destino"], e["asunto"])
+                except Exception as ex:
+                    # No exponemos credenciales ni el intercambio SMTP
+                    current_app.logger.error("Error enviando email a %s: %s", e["destino"], ex)
+    except Exception as ex:
+        # Falló la conexión SMTP; no relanzamos, dejamos que el flujo de compra continúe.
+        current_app.logger.error("Error conectando al servidor SMTP: %s", ex)
+
+
+def enviar_ticket_async(
+    *,
+    destino: str,
+    asunto: str,
+    cuerpo: str,
+    adjunto_path: Optional[str] = None,
+) -> Future:
+    """
+    Igual que enviar_ticket() pero no bloquea: lo ejecuta en el pool "email"
+    con su propio app context. Todo lo que dependa del request (p.ej.
+    url_for(..., _external=True)) tiene que resolverse antes de llamar.
+    """
+    return background.submit(
+        "email", enviar_ticket,
+        destino=destino, asunto=asunto, cuerpo=cuerpo, adjunto_path=adjunto_path,
+    )
@@ -11,9 +11,10 @@ import logging
 from typing import Dict, Any, Optional, List
 from decimal import Decimal
 
-import mercadopago
 from flask import current_app, url_for
 
+from app.service import mp_http
+
 logger = logging.getLogger(__name__)
 
 class MercadoPagoService:
@@ -26,8 +27,9 @@ class MercadoPagoService:
         if not self.access_token:
             raise ValueError("MP_ACCESS_TOKEN no configurado")
         
-        # Inicializar SDK
-        self.sdk = mercadopago.SDK(self.access_token)
+        # Inicializar SDK sobre la Session HTTP compartida (keep-alive con
+        # api.mercadopago.com, ver app/service/mp_http.py)
+        self.sdk = mp_http.sdk(self.access_token)
     
     def crear_preferencia_pago(self, 
                               items: List[Dict[str, Any]], 
@@ -205,19 +207,39 @@ class MercadoPagoService:
                 "details": str(e)
             }
     
-    def crear_items_desde_carrito(self, entradas: List[Dict], combos: List[Dict]) -> List[Dict[str, Any]]:
+    def crear_items_desde_carrito(self, entradas: List[Dict], combos: List[Dict], *,
+                                  funcion: Optional[Dict] = None,
+                                  asientos: Optional[List[str]] = None,
+                                  precio_entrada: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         Convierte entradas y combos a formato de items de MercadoPago
         
         Args:
-            entradas: Lista de entradas seleccionadas
+            entradas: Lista de entradas seleccionadas (un item por entrada)
             combos: Lista de combos seleccionados
+            funcion: Datos de la función (funcion_id, pelicula, fecha, hora);
+                junto con asientos y precio_entrada arma un único item
+            asientos: Asientos de la función, van como quantity del item
+            precio_entrada: Precio unitario de la entrada
             
         Returns:
             Lista de items en formato MercadoPago
         """
         items = []
         
+        # Todas las entradas de una función cuestan lo mismo: un solo item con
+        # quantity=N en lugar de N items iguales (MP suma unit_price * quantity)
+        if funcion is not None and asientos:
+            items.append({
+                "id": f"entrada_{funcion.get('funcion_id')}",
+                "title": f"Entrada - {funcion.get('pelicula') or 'Película'} - Asientos {', '.join(asientos)}",
+                "description": f"Función: {funcion.get('fecha', '')} {funcion.get('hora', '')}",
+                "category_id": "tickets",
+                "quantity": len(asientos),
+                "unit_price": float(precio_entrada or 0),
+                "currency_id": "ARS"
+            })
+        
         # Agregar entradas
         for entrada in entradas:
             items.append({
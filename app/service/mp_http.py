@@ -0,0 +1,85 @@
+# app/service/mp_http.py
+# -*- coding: utf-8 -*-
+"""
+Cliente HTTP compartido para la API de Mercado Pago.
+
+Una sola requests.Session por proceso (keep-alive + pool de conexiones), así
+el handshake TCP+TLS con api.mercadopago.com se paga una vez y no en cada
+llamada. La usan tanto el chequeo de token (/users/me) como el SDK, al que se
+le inyecta vía http_client.
+
+Se crea perezosamente en el primer uso (no en create_app): con preload_app de
+gunicorn, un socket abierto antes del fork quedaría compartido entre workers.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+try:  # orjson es opcional: parser en C, bastante más rápido que json
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as _json_loads
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from mercadopago import SDK
+from mercadopago.http import HttpClient
+
+MP_API_BASE = "https://api.mercadopago.com"
+# (connect, read) en segundos
+DEFAULT_TIMEOUT = (3, 7)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    s = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    return s
+
+
+def get_session() -> requests.Session:
+    """Session compartida del proceso (se crea en el primer uso)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+class PooledHttpClient(HttpClient):
+    """
+    HttpClient del SDK que reutiliza la Session compartida en vez de abrir una
+    nueva por llamada. Los reintentos los maneja el adapter montado en la
+    Session, por eso se ignoran los parámetros de retry por llamada.
+    """
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        kwargs.pop("retry_on", None)
+        kwargs.pop("backoff_factor", None)
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = DEFAULT_TIMEOUT
+        api_result = get_session().request(method, url, **kwargs)
+        response = {"status": api_result.status_code, "response": None}
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                # Las respuestas de MP (preferencias, pagos) son lo más pesado
+                # que se parsea en el checkout: orjson en lugar de requests.json()
+                response["response"] = _json_loads(api_result.content)
+            except ValueError:
+                response["response"] = {"message": api_result.text}
+        return response
+
+
+_http_client = PooledHttpClient()
+
+
+def sdk(token: str) -> SDK:
+    """SDK de Mercado Pago que usa la Session compartida."""
+    return SDK(token, http_client=_http_client)
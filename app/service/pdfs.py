@@ -30,6 +30,7 @@ import os
 import re
 import uuid
 from datetime import datetime
+from decimal import Decimal
 from typing import Iterable, Mapping, Optional, Sequence, Union
 
 from fpdf import FPDF
@@ -41,7 +42,7 @@ class PDFGenerationError(Exception):
     """Error al generar el PDF del comprobante."""
 
 
-Number = Union[int, float]
+Number = Union[int, float, Decimal]
 ComboDict = Mapping[str, Union[str, Number]]
 StrSeq = Sequence[str]
 
@@ -64,7 +65,9 @@ def _abs_storage_dir(rel_or_abs: str) -> str:
 
 def _format_currency(value: Number) -> str:
     try:
-        return f"$ {float(value):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        # Decimal se formatea tal cual (montos exactos en centavos); el resto vía float
+        v = value if isinstance(value, Decimal) else float(value)
+        return f"$ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
     except Exception:
         return f"$ {value}"
 
@@ -456,8 +459,15 @@ def generar_comprobante_pdf(
         
         pdf.set_text_color(0, 0, 0)
 
-        # Guardar
-        pdf.output(pdf_path)
+        # Guardar. fpdf2 arma el documento en memoria y output() lo escribe de
+        # una vez; ante un comprobante de ~10 KB no hay nada que ganar
+        # escribiendo en streaming ni mapeando el archivo al adjuntarlo.
+        # Se escribe a un temporal y se renombra: la existencia del archivo es
+        # la señal de "listo" que usa archivos.descargar_comprobante (cualquier
+        # worker), así que nunca debe verse un PDF a medio escribir.
+        tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+        pdf.output(tmp_path)
+        os.replace(tmp_path, pdf_path)
 
         return pdf_path
 
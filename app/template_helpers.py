@@ -0,0 +1,51 @@
+# app/template_helpers.py
+# -*- coding: utf-8 -*-
+"""
+Filtros Jinja y context processor de la app (registrados en create_app):
+- peso:      número -> "$ 1.234,56"
+- from_json: string JSON -> objeto Python
+- inject_auth_functions: expone current_user / is_logged_in / is_admin
+"""
+
+from __future__ import annotations
+
+try:  # orjson es opcional: parser en C, bastante más rápido que json
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as _json_loads
+
+from app.blueprints.auth import current_user, is_logged_in, is_admin
+
+
+def peso(value):
+    """Formatea números como moneda ARS: $ 1.234,56"""
+    try:
+        cents = int(round(float(value) * 100))
+    except Exception:
+        return value
+    sign = "-" if cents < 0 else ""
+    entero, dec = divmod(abs(cents), 100)
+    # Un solo replace: separador de miles "." (los decimales van aparte con ",")
+    return f"$ {sign}{entero:,}".replace(",", ".") + f",{dec:02d}"
+
+
+def from_json(value):
+    """Convierte string JSON a objeto Python"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return _json_loads(value)
+    except Exception:
+        return []
+
+
+# Las funciones se llaman desde la plantilla, así que el dict es siempre el mismo
+_AUTH_CONTEXT = {
+    'current_user': current_user,
+    'is_logged_in': is_logged_in,
+    'is_admin': is_admin
+}
+
+
+def inject_auth_functions():
+    return _AUTH_CONTEXT
@@ -10,6 +10,10 @@ sudo apt update && sudo apt upgrade -y
 sudo apt install -y python3.11 python3.11-venv python3.11-dev python3-pip
 sudo apt install -y nginx git supervisor
 
+# Redis: storage del rate limiting compartido entre workers (RATELIMIT_STORAGE_URI)
+sudo apt install -y redis-server
+sudo systemctl enable --now redis-server
+
 # Crear usuario para la aplicación
 sudo useradd -m -s /bin/bash cinema3d
 sudo mkdir -p /var/www/cinema3d
@@ -31,6 +35,9 @@ sudo -u cinema3d ./venv/bin/pip install -r requirements.txt
 # Crear directorios necesarios
 sudo -u cinema3d mkdir -p logs static/comprobantes static/qr
 
+# Tareas periódicas (purge-reset-tokens)
+sudo install -m 644 -o root -g root deploy/cron_cinema3d /etc/cron.d/cinema3d
+
 # Configurar permisos
 sudo chown -R cinema3d:www-data /var/www/cinema3d
 sudo chmod -R 755 /var/www/cinema3d
@@ -6,8 +6,12 @@ import os
 # Configuración del servidor
 bind = "127.0.0.1:8000"
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
+# gthread: el hash de contraseñas (scrypt de OpenSSL vía hashlib) libera el
+# GIL, así que un login/registro no frena a los demás requests del worker.
+worker_class = "gthread"
+# La concurrencia por worker la fija `threads` (GUNICORN_THREADS): gthread
+# ignora worker_connections, que sólo aplica a workers async (gevent/eventlet).
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
 timeout = 120
 keepalive = 5
 max_requests = 1000
@@ -1,5 +1,17 @@
+import os
+import tempfile
 import unittest
+import uuid
+from unittest import mock
+
+from flask import session
+from werkzeug.security import check_password_hash, generate_password_hash
+
 from app import create_app
+from app import db as db_mod
+from app.auth_utils import DEFAULT_PASSWORD_HASH_METHOD, hash_password
+from app.blueprints.auth import _LOGIN_ERROR
+from app.extensions import limiter
 
 class TestApp(unittest.TestCase):
     def setUp(self):
@@ -18,5 +30,258 @@ class TestApp(unittest.TestCase):
 
     # Aquí puedes agregar más pruebas unitarias según sea necesario
 
+
+class TestAppBDTemporal(unittest.TestCase):
+    """Base: app sobre una BD temporal (no toca usuarios.db)."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"DB_PATH": os.path.join(self.tmpdir.name, "test.db")})
+        self.env.start()
+        self.app = create_app()
+        self.app.testing = True
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def crear_usuario(self, password="secreta123", method=None, nro_documento="30111222", email="ana@test.com"):
+        pwd_hash = generate_password_hash(password, method=method) if method else hash_password(password)
+        return db_mod.upsert_usuario(
+            nombre="Ana", apellido="Test", tipo_documento="DNI",
+            nro_documento=nro_documento, contrasena_hash=pwd_hash, email=email,
+        )
+
+    def crear_trx(self, estado):
+        return db_mod.get_conn().execute(
+            "INSERT INTO transacciones (usuario_email, monto_cents, total_pesos, estado) VALUES (?,?,?,?) RETURNING id",
+            ("ana@test.com", 100, 1, estado),
+        ).fetchone()["id"]
+
+
+class TestLogin(TestAppBDTemporal):
+    def test_error_generico_usuario_inexistente_y_clave_incorrecta(self):
+        self.crear_usuario()
+        r1 = self.client.post('/login', data={'login_id': 'ana@test.com', 'password': 'incorrecta'})
+        r2 = self.client.post('/login', data={'login_id': 'nadie@test.com', 'password': 'incorrecta'})
+        self.assertEqual(r1.status_code, 400)
+        self.assertEqual(r2.status_code, 400)
+        self.assertIn(_LOGIN_ERROR, r1.data.decode('utf-8'))
+        self.assertIn(_LOGIN_ERROR, r2.data.decode('utf-8'))
+
+    def test_login_ve_cambio_de_clave_sin_cache(self):
+        user_id = self.crear_usuario(password="vieja123")
+        r = self.client.post('/login', data={'login_id': '30111222', 'password': 'vieja123'})
+        self.assertEqual(r.status_code, 302)
+        db_mod.execute("UPDATE usuarios SET contrasena = ? WHERE id = ?", [hash_password("nueva123"), user_id])
+        otro = self.app.test_client()
+        self.assertEqual(otro.post('/login', data={'login_id': '30111222', 'password': 'vieja123'}).status_code, 400)
+        self.assertEqual(otro.post('/login', data={'login_id': '30111222', 'password': 'nueva123'}).status_code, 302)
+
+    def test_rehash_on_verify(self):
+        user_id = self.crear_usuario(method="pbkdf2:sha256:1000")
+        r = self.client.post('/login', data={'login_id': 'ana@test.com', 'password': 'secreta123'})
+        self.assertEqual(r.status_code, 302)
+        stored = db_mod.query_one("SELECT contrasena FROM usuarios WHERE id = ?", [user_id])["contrasena"]
+        self.assertTrue(stored.startswith(DEFAULT_PASSWORD_HASH_METHOD + "$"))
+        self.assertTrue(check_password_hash(stored, "secreta123"))
+
+
+class TestRegistro(TestAppBDTemporal):
+    DATOS = {
+        'nombre': 'Ana', 'apellido': 'Test', 'tipo_documento': 'DNI',
+        'nro_documento': '30111222', 'contrasena': 'secreta123', 'email': 'ana@test.com',
+    }
+
+    def test_registro_crea_usuario(self):
+        r = self.client.post('/registro', data=self.DATOS)
+        self.assertEqual(r.status_code, 302)
+        row = db_mod.query_one("SELECT id FROM usuarios WHERE nro_documento = ?", ['30111222'])
+        self.assertIsNotNone(row)
+        with self.client.session_transaction() as s:
+            self.assertEqual(s["user"]["id"], row["id"])
+
+    def test_registro_duplicado_por_carrera(self):
+        """Duplicado que pasa la validación previa: ON CONFLICT DO NOTHING -> 400, sin excepción."""
+        from app.blueprints import auth
+        self.crear_usuario()
+        validar = auth._validate_registro_form
+        sin_chequeo_previo = lambda form: validar(form, _query_all=lambda *a, **k: [])
+        with mock.patch.object(auth, "_validate_registro_form", sin_chequeo_previo):
+            r = self.client.post('/registro', data=self.DATOS)
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("ya están registrados", r.data.decode('utf-8'))
+        n = db_mod.query_one("SELECT COUNT(*) AS n FROM usuarios")["n"]
+        self.assertEqual(n, 1)
+
+
+class TestTotales(TestAppBDTemporal):
+    def test_calcular_totales_en_centavos(self):
+        from app.blueprints import pago
+        self.app.config["TICKET_PRICE"] = "5000.10"
+        with self.app.test_request_context():
+            session["seats"] = ["A1", "A2", "A3"]
+            session["combos"] = ["1", "2", "1"]
+            entradas, combos, total, combos_sel, seats, _ = pago._calcular_totales()
+        self.assertEqual(entradas, 1500030)
+        self.assertEqual(combos, 400000)
+        self.assertEqual(total, 1900030)
+        self.assertTrue(all(isinstance(v, int) for v in (entradas, combos, total)))
+        self.assertEqual([c["id"] for c in combos_sel], [1, 2])
+        self.assertEqual(pago._fmt_cents(total), "19000.30")
+
+
+class TestCartelera(TestAppBDTemporal):
+    def setUp(self):
+        super().setUp()
+        # Una BD nueva toma la tabla funciones de la migración MP, sin trailer_url
+        db_mod._ensure_column(db_mod.get_conn(), "funciones", "trailer_url", "TEXT")
+
+    def crear_funcion(self, pelicula_id="peli-1", hora="20:00"):
+        return db_mod.get_conn().execute(
+            "INSERT INTO funciones (pelicula_id, titulo, fecha, hora, sala) VALUES (?,?,?,?,?) RETURNING id",
+            (pelicula_id, "Peli", "2999-01-01", hora, "Sala 1"),
+        ).fetchone()["id"]
+
+    def test_sin_indice_redundante_por_fecha(self):
+        nombres = {r["name"] for r in db_mod.query_all("PRAGMA index_list(funciones)")}
+        self.assertIn("idx_funciones_fecha_hora", nombres)
+        self.assertNotIn("idx_funciones_fecha", nombres)
+
+    def test_stamp_cambia_con_cada_escritura(self):
+        s0 = db_mod.get_catalog_stamp()
+        fid = self.crear_funcion()
+        s1 = db_mod.get_catalog_stamp()
+        db_mod.execute("UPDATE funciones SET sala = 'Sala 2' WHERE id = ?", [fid])
+        s2 = db_mod.get_catalog_stamp()
+        db_mod.execute("DELETE FROM funciones WHERE id = ?", [fid])
+        s3 = db_mod.get_catalog_stamp()
+        self.assertEqual(len({s0, s1, s2, s3}), 4)
+
+    def test_cache_ve_cambios_de_otro_worker(self):
+        from app.blueprints import venta
+        self.crear_funcion(hora="18:00")
+        with self.app.app_context():  # g nuevo, como en cada request
+            self.assertEqual(len(venta._movies_source()[0]["funciones"]), 1)
+        # Escritura sin pasar por este proceso (otro worker/admin)
+        self.crear_funcion(hora="22:00")
+        with self.app.app_context():
+            self.assertEqual(len(venta._movies_source()[0]["funciones"]), 2)
+
+    def test_seleccionar_funcion_por_id(self):
+        fid = self.crear_funcion()
+        with self.client:
+            r = self.client.post('/seleccionar-funcion', data={"movie_id": "peli-1", "funcion_id": fid})
+            self.assertTrue(r.location.endswith("/reserva-asientos"))
+            self.assertEqual(session["movie_selection"]["hora"], "20:00")
+
+    def test_seleccionar_funcion_inexistente_o_de_otra_pelicula(self):
+        fid = self.crear_funcion()
+        for data in ({"movie_id": "otra", "funcion_id": fid}, {"movie_id": "peli-1", "funcion_id": fid + 1}):
+            with self.client:
+                r = self.client.post('/seleccionar-funcion', data=data)
+                self.assertTrue(r.location.endswith("/cartelera"))
+                self.assertNotIn("movie_selection", session)
+
+
+class TestDescargaComprobante(TestAppBDTemporal):
+    def setUp(self):
+        super().setUp()
+        self.app.config["COMPROBANTES_DIR"] = self.tmpdir.name
+
+    def test_trx_inexistente_404(self):
+        self.assertEqual(self.client.get('/comprobante/999/descargar').status_code, 404)
+
+    def test_aprobada_sin_pdf_pide_reintento(self):
+        trx_id = self.crear_trx("APROBADO")
+        r = self.client.get(f'/comprobante/{trx_id}/descargar')
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r.headers["Retry-After"], "3")
+
+    def test_no_aprobada_sin_pdf_404(self):
+        trx_id = self.crear_trx("PENDIENTE")
+        self.assertEqual(self.client.get(f'/comprobante/{trx_id}/descargar').status_code, 404)
+
+    def test_pdf_en_disco_se_descarga(self):
+        trx_id = self.crear_trx("APROBADO")
+        with open(os.path.join(self.tmpdir.name, f"comprobante_trx_{trx_id}.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4")
+        r = self.client.get(f'/comprobante/{trx_id}/descargar')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, b"%PDF-1.4")
+        r.close()
+
+
+class TestWebhookMP(TestAppBDTemporal):
+    def sdk_con_pago(self, status, external_reference):
+        sdk = mock.Mock()
+        sdk.payment.return_value.get.return_value = {
+            "response": {"status": status, "external_reference": str(external_reference)}
+        }
+        return sdk
+
+    def test_webhook_encola_la_sincronizacion(self):
+        from app.blueprints import pago
+        with mock.patch("app.service.background.submit") as submit:
+            r = self.client.post('/pago/mp/webhook', json={"type": "payment", "data": {"id": 123}})
+        self.assertEqual(r.status_code, 200)
+        submit.assert_called_once_with("mp", pago._sincronizar_pago_mp, "123")
+
+    def test_webhook_ignora_otros_topicos(self):
+        with mock.patch("app.service.background.submit") as submit:
+            r = self.client.post('/pago/mp/webhook', json={"type": "merchant_order", "data": {"id": 1}})
+        self.assertEqual(r.status_code, 200)
+        submit.assert_not_called()
+
+    def test_sincronizar_actualiza_una_vez_y_no_retrocede(self):
+        from app.blueprints import pago
+        trx_id = self.crear_trx("PENDIENTE")
+        with mock.patch.object(pago, "_sdk_mp", return_value=self.sdk_con_pago("approved", trx_id)):
+            self.assertTrue(pago._sincronizar_pago_mp("123"))
+            self.assertFalse(pago._sincronizar_pago_mp("123"))  # webhook repetido
+        with mock.patch.object(pago, "_sdk_mp", return_value=self.sdk_con_pago("rejected", trx_id)):
+            self.assertFalse(pago._sincronizar_pago_mp("123"))
+        row = db_mod.query_one("SELECT estado, mp_payment_id FROM transacciones WHERE id = ?", [trx_id])
+        self.assertEqual((row["estado"], row["mp_payment_id"]), ("APROBADO", "123"))
+
+
+@unittest.skipIf(limiter is None, "Flask-Limiter no instalado")
+class TestRateLimits(TestAppBDTemporal):
+    def test_forgot_password_5_por_minuto(self):
+        login_id = f"rl-{uuid.uuid4().hex}@test.com"
+        codes = [self.client.post('/forgot-password', data={'login_id': login_id}).status_code for _ in range(6)]
+        self.assertNotIn(429, codes[:5])
+        self.assertEqual(codes[5], 429)
+
+    def test_forgot_password_10_por_minuto_por_ip(self):
+        # Identificadores distintos desde la misma IP: frena el barrido de cuentas
+        headers = {"X-Forwarded-For": "10.0.1.1"}
+        env_a = {"REMOTE_ADDR": "127.0.0.1"}
+        codes = [
+            self.client.post('/forgot-password', data={'login_id': f"rl-{uuid.uuid4().hex}@test.com"},
+                             headers=headers, environ_base=env_a).status_code
+            for _ in range(11)
+        ]
+        self.assertNotIn(429, codes[:10])
+        self.assertEqual(codes[10], 429)
+
+    def test_reset_password_5_por_minuto_por_ip(self):
+        token = uuid.uuid4().hex
+        env_a = {"REMOTE_ADDR": "127.0.0.1"}
+        codes = [
+            self.client.get(f'/reset-password/{token}', headers={"X-Forwarded-For": "10.0.0.1"}, environ_base=env_a).status_code
+            for _ in range(6)
+        ]
+        self.assertNotIn(429, codes[:5])
+        self.assertEqual(codes[5], 429)
+        # Otro cliente detrás del mismo nginx tiene su propio balde
+        r = self.client.get(f'/reset-password/{token}', headers={"X-Forwarded-For": "10.0.0.2"}, environ_base=env_a)
+        self.assertNotEqual(r.status_code, 429)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -4,11 +4,16 @@
 Script de prueba para el sistema de recuperación de contraseñas
 """
 
+import hashlib
 import sys
 import os
+import tempfile
+import unittest
+from unittest import mock
 sys.path.insert(0, os.path.abspath('.'))
 
 from app import create_app
+from app import db as db_mod
 from app.db_migrations import migrate_add_password_reset_support
 from app.db import create_password_reset_token, validate_password_reset_token, use_password_reset_token
 
@@ -88,5 +93,82 @@ def test_password_reset_system():
         
         return True
 
+# ---------------------------------------------------------------------
+# Casos puntuales (BD temporal: no tocan usuarios.db)
+# ---------------------------------------------------------------------
+
+class TestResetTokens(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"DB_PATH": os.path.join(self.tmpdir.name, "test.db")})
+        self.env.start()
+        self.app = create_app()
+        self.app.testing = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def crear_usuario(self, nro_documento="30111222", email="reset@test.com", contrasena_hash="x"):
+        return db_mod.upsert_usuario(
+            nombre="Ana", apellido="Reset", tipo_documento="DNI",
+            nro_documento=nro_documento, contrasena_hash=contrasena_hash, email=email,
+        )
+
+    def contrasena(self, user_id):
+        return db_mod.query_one("SELECT contrasena FROM usuarios WHERE id = ?", [user_id])["contrasena"]
+
+    def test_token_se_guarda_hasheado(self):
+        """En la BD queda sha256(token), nunca el token en claro."""
+        user_id = self.crear_usuario()
+        token = create_password_reset_token(user_id)
+
+        stored = db_mod.query_one(
+            "SELECT token FROM password_reset_tokens WHERE user_id = ?", [user_id]
+        )["token"]
+        self.assertEqual(stored, hashlib.sha256(token.encode("utf-8")).hexdigest())
+        self.assertNotEqual(stored, token)
+        self.assertEqual(validate_password_reset_token(token), user_id)
+        # El hash guardado no sirve como token
+        self.assertIsNone(validate_password_reset_token(stored))
+
+    def test_create_schema_purga_tokens_en_claro(self):
+        """BD anterior a v5: se borran los tokens en claro y se conservan los hasheados."""
+        user_id = self.crear_usuario()
+        token = create_password_reset_token(user_id)
+        conn = db_mod.get_conn()
+        conn.execute(
+            "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)",
+            [user_id, "token-viejo-en-claro", 2**31],
+        )
+        db_mod.set_schema_version(4)
+
+        db_mod.create_schema()
+
+        tokens = [r["token"] for r in db_mod.query_all("SELECT token FROM password_reset_tokens")]
+        self.assertNotIn("token-viejo-en-claro", tokens)
+        self.assertEqual(validate_password_reset_token(token), user_id)
+
+    def test_reset_password_with_token_consume_el_token_una_vez(self):
+        """Token + contraseña en una transacción; el segundo uso no cambia nada."""
+        user_id = self.crear_usuario()
+        token = create_password_reset_token(user_id)
+
+        self.assertEqual(db_mod.reset_password_with_token(token, "hash-nuevo"), user_id)
+        self.assertEqual(self.contrasena(user_id), "hash-nuevo")
+        self.assertIsNone(validate_password_reset_token(token))
+
+        self.assertIsNone(db_mod.reset_password_with_token(token, "hash-otro"))
+        self.assertEqual(self.contrasena(user_id), "hash-nuevo")
+
+    def test_reset_password_with_token_invalido(self):
+        user_id = self.crear_usuario()
+        self.assertIsNone(db_mod.reset_password_with_token("no-existe", "hash-nuevo"))
+        self.assertEqual(self.contrasena(user_id), "x")
+
+
 if __name__ == "__main__":
     test_password_reset_system()
\ No newline at end of file